@@ -0,0 +1,189 @@
+# coding: utf-8
+import os
+import struct
+
+# MPEG Layer III 的比特率表（kbps），按比特率索引取值
+_MPEG1_L3_BITRATES = (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+_MPEG2_L3_BITRATES = (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160)
+# 采样率表，按版本位取值：0 为 MPEG2.5，2 为 MPEG2，3 为 MPEG1
+_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+def _mp3_frame(data, pos):
+    """
+    解析 pos 处的 MPEG Layer III 帧头，返回 (帧长度, Xing/Info 标签的偏移, 每帧采样数, 采样率)，
+    不是有效帧头时返回 None。
+    """
+    if pos + 4 > len(data) or data[pos] != 0xFF or (data[pos + 1] & 0xE0) != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = (data[pos + 1] >> 1) & 3
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    padding = (data[pos + 2] >> 1) & 1
+    mono = (data[pos + 3] >> 6) == 3
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    if version == 3:
+        length = 144000 * _MPEG1_L3_BITRATES[bitrate_index] // sample_rate + padding
+        side_info = 17 if mono else 32
+        samples = 1152
+    else:
+        length = 72000 * _MPEG2_L3_BITRATES[bitrate_index] // sample_rate + padding
+        side_info = 9 if mono else 17
+        samples = 576
+    return length, pos + 4 + side_info, samples, sample_rate
+
+
+def mp3_frames(data):
+    """
+    去掉 MP3 数据中的 ID3 标签和 Xing/Info/VBRI 信息帧，只保留音频帧，拼接后仍是合法的 MP3 流。
+    """
+    start, end = 0, len(data)
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        start = 10 + size + (10 if data[5] & 0x10 else 0)
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    # 跳到第一个有效的帧头
+    while start < end and _mp3_frame(data, start) is None:
+        start += 1
+    frame = _mp3_frame(data, start)
+    if frame is not None:
+        length, tag = frame[:2]
+        if data[tag:tag + 4] in (b"Xing", b"Info") or data[start + 36:start + 40] == b"VBRI":
+            start += length
+    return data[start:end]
+
+
+def mp3_duration(data):
+    """返回 mp3_frames 处理后的 MP3 数据的时长（秒），按帧头逐帧累计。"""
+    pos, seconds = 0, 0.0
+    while pos < len(data):
+        frame = _mp3_frame(data, pos)
+        if frame is None:
+            break
+        length, _, samples, sample_rate = frame
+        seconds += samples / sample_rate
+        pos += length
+    return seconds
+
+
+def mp3_silence(header, seconds):
+    """
+    按 header（一个音频帧的 4 字节帧头）的格式生成约 seconds 秒的静音帧，可以直接拼接在同格式的 MP3 流中。
+
+    帧头去掉 CRC 和填充位，帧内的边信息和主数据全为零，解码后即为静音。
+    """
+    header = bytes([header[0], header[1] | 0x01, header[2] & ~0x02 & 0xFF, header[3]])
+    length, _, samples, sample_rate = _mp3_frame(header + bytes(4), 0)
+    count = int(round(seconds * sample_rate / samples))
+    return (header + bytes(length - 4)) * count
+
+
+def _wav_parts(data):
+    """返回 WAV 数据的 (fmt 块内容, PCM 数据)。"""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("不是有效的 WAV 数据")
+    pos, fmt = 12, None
+    while pos + 8 <= len(data):
+        chunk_id, size = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        body = data[pos + 8:pos + 8 + size]
+        if chunk_id == b"fmt ":
+            fmt = body
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV 数据缺少 fmt 块")
+            # 流式生成的 WAV 的数据长度可能是占位值，此时 body 即为剩余的全部数据
+            return fmt, body
+        pos += 8 + size + (size & 1)
+    raise ValueError("WAV 数据缺少 data 块")
+
+
+class AudioMerger:
+    """
+    在进程内把多个音频片段依次追加写入同一个输出文件，不产生中间文件。
+
+    输出为 .wav 时拼接 PCM 数据并在关闭时回填头部长度；否则按 MP3 处理，直接追加音频帧。
+    duration 为已写入的时长（秒），append 指定 at 时先补静音，使片段从时间线上的该位置开始。
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.wav = output_path.lower().endswith(".wav")
+        self.segments = 0
+        self.duration = 0.0
+        self._fmt = None
+        self._data_size = 0
+        self._file = open(output_path, "wb")
+
+    def append(self, data, at=None):
+        """
+        追加一个片段，返回片段实际开始的时间（秒）。
+
+        参数:
+        - data: 音频字节或音频文件路径。
+        - at: 片段在时间线上的开始时间（秒），晚于当前时长时先写入静音；早于当前时长时紧接着上一个片段。
+        """
+        if isinstance(data, str):
+            with open(data, "rb") as f:
+                data = f.read()
+        if self.wav:
+            fmt, pcm = _wav_parts(data)
+            byte_rate, block_align, bits = struct.unpack("<IHH", fmt[8:16])
+            silence = b""
+            if at is not None and at > self.duration:
+                # 8 位 PCM 的静音值为 0x80，其余为 0
+                silence = (b"\x80" if bits == 8 else b"\0") * (
+                    int((at - self.duration) * byte_rate) // block_align * block_align)
+            if self._fmt is None:
+                self._fmt = fmt
+                self._file.write(b"RIFF" + struct.pack("<I", 0) + b"WAVE")
+                self._file.write(b"fmt " + struct.pack("<I", len(fmt)) + fmt + (b"\0" if len(fmt) & 1 else b""))
+                self._file.write(b"data" + struct.pack("<I", 0))
+            elif fmt != self._fmt:
+                raise ValueError("WAV 片段的音频格式不一致，无法直接拼接")
+            self._file.write(silence + pcm)
+            self._data_size += len(silence) + len(pcm)
+            start = self.duration + len(silence) / byte_rate
+            self.duration = start + len(pcm) / byte_rate
+        else:
+            audio = mp3_frames(data)
+            if at is not None and at > self.duration and _mp3_frame(audio, 0) is not None:
+                silence = mp3_silence(audio[:4], at - self.duration)
+                self._file.write(silence)
+                self.duration += mp3_duration(silence)
+            start = self.duration
+            self._file.write(audio)
+            self.duration += mp3_duration(audio)
+        self._file.flush()
+        self.segments += 1
+        return start
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self.wav and self._fmt is not None:
+            header_size = 4 + 8 + len(self._fmt) + (len(self._fmt) & 1) + 8
+            self._file.seek(4)
+            self._file.write(struct.pack("<I", header_size + self._data_size))
+            self._file.seek(header_size - 4 + 8)
+            self._file.write(struct.pack("<I", self._data_size))
+        self._file.close()
+
+    def discard(self):
+        """关闭并删除输出文件。"""
+        self._file.close()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
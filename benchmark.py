@@ -0,0 +1,289 @@
+# coding: utf-8
+"""
+离线端到端基准测试：生成合成视频，启动本地的假 OpenAI 服务，依次测量帧提取、图像分析、语音合成和音频合并，
+以 JSON 输出结果，便于比较不同版本的性能。不需要网络。
+
+用法：python benchmark.py --seconds 60 --latency 0.2 --error-every 5 --output result.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+from audio_merge import AudioMerger
+from http_pool import HttpPool
+from metrics import Metrics
+from rate_limit import RateLimiter
+from video_narrator import ImageAnalyzer, split_sentences
+from videos import extract_frames
+
+# 一个静音的 MPEG1 Layer III 帧（128kbps、44.1kHz），长度 417 字节，约 26 毫秒
+_MP3_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+def make_video(path, seconds=30, fps=30, width=640, height=360):
+    """用 cv2.VideoWriter 生成一段带运动色块和噪声的合成视频，返回写入的帧数。"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    if not writer.isOpened():
+        raise IOError(f"无法创建视频文件: {path}")
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+    total = int(seconds * fps)
+    size = max(8, min(width, height) // 6)
+    try:
+        for i in range(total):
+            frame = background.copy()
+            # 每秒换一次颜色，色块沿水平方向移动
+            if i % fps == 0:
+                color = tuple(int(c) for c in rng.integers(64, 256, 3))
+            x = int((width - size) * (i % (fps * 4)) / (fps * 4))
+            y = (height - size) // 2
+            cv2.rectangle(frame, (x, y), (x + size, y + size), color, -1)
+            cv2.putText(frame, str(i), (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return total
+
+
+class FakeOpenAIServer:
+    """
+    在本地端口上模拟 chat.completions 和 audio.speech 接口，通过 ImageAnalyzer 的 base_url 访问。
+
+    参数:
+    - latency: 图像分析请求的响应延迟（秒）。
+    - tts_latency: 语音合成请求的响应延迟（秒）。
+    - error_every: 每 N 个请求返回一次 429（带 retry-after-ms 响应头），0 表示不注入错误。
+    - retry_after: 注入 429 时建议的等待时间（秒）。
+    """
+
+    def __init__(self, latency=0.1, tts_latency=0.1, error_every=0, retry_after=0.2):
+        self.latency = latency
+        self.tts_latency = tts_latency
+        self.error_every = error_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def _count(self):
+        """记录一个请求，需要注入 429 时返回 True。"""
+        with self._lock:
+            self.requests += 1
+            reject = self.error_every > 0 and self.requests % self.error_every == 0
+            if reject:
+                self.rejected += 1
+            return reject
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type, headers=None):
+                self.send_response(status)
+                self.send_header("content-type", content_type)
+                self.send_header("content-length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("content-length", 0))) or b"{}")
+                if server._count():
+                    body = json.dumps({"error": {"message": "Rate limit reached", "type": "requests",
+                                                 "code": "rate_limit_exceeded"}}).encode("utf-8")
+                    self._send(429, body, "application/json",
+                               {"retry-after-ms": str(int(server.retry_after * 1000))})
+                    return
+                if self.path.endswith("/chat/completions"):
+                    time.sleep(server.latency)
+                    self._send(200, server._chat_body(request), "application/json",
+                               {"x-ratelimit-remaining-requests": "10000", "x-ratelimit-reset-requests": "1s",
+                                "x-ratelimit-remaining-tokens": "10000000", "x-ratelimit-reset-tokens": "1s"})
+                elif self.path.endswith("/audio/speech"):
+                    time.sleep(server.tts_latency)
+                    # 按文本长度生成静音音频，每个字符约 0.1 秒
+                    self._send(200, _MP3_FRAME * (4 * len(request.get("input", ""))), "audio/mpeg")
+                else:
+                    self._send(404, b'{"error": {"message": "not found"}}', "application/json")
+
+        return Handler
+
+    def _chat_body(self, request):
+        messages = request.get("messages", [])
+        content = messages[-1].get("content") if messages else ""
+        images = sum(1 for part in content if part.get("type") == "image_url") if isinstance(content, list) else 0
+        if request.get("response_format", {}).get("type") == "json_object":
+            text = json.dumps({"narrations": [f"第 {i + 1} 个画面里，一个色块正在移动。" for i in range(images)]},
+                              ensure_ascii=False)
+        elif images:
+            text = "画面中的色块正小心翼翼地向右移动，仿佛在躲避什么。"
+        else:
+            text = "色块一路向右移动。"
+        return json.dumps({
+            "id": "chatcmpl-benchmark", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "gpt-4o"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": 100 + 255 * images, "completion_tokens": 30,
+                      "total_tokens": 130 + 255 * images},
+        }, ensure_ascii=False).encode("utf-8")
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def run_benchmark(seconds=30, fps=30, width=640, height=360, frame_interval=1, sampling="seek", workers=1,
+                  concurrency=1, batch_size=1, tts_concurrency=4, latency=0.1, tts_latency=0.1, error_every=0,
+                  logger=None):
+    """
+    执行一次完整的基准测试并返回结果字典。
+
+    参数:
+    - seconds、fps、width、height: 合成视频的长度（秒）、帧率和分辨率。
+    - frame_interval、sampling、workers: 传给 extract_frames。
+    - concurrency、batch_size: 传给 ImageAnalyzer.analyze_frames。
+    - tts_concurrency: 同时进行的语音合成请求数。
+    - latency、tts_latency、error_every: 假服务的响应延迟和 429 注入频率，见 FakeOpenAIServer。
+    - logger: 日志记录器，默认为当前模块的记录器。
+
+    返回:
+    - 包含 config、extraction、analysis、tts、merge、wall_seconds、http_pool 和完整 metrics 报告的字典，时间单位为秒。
+      analysis 中 request_latency 为每个请求的耗时分位数，frame_latency 按每个请求的平均帧数折算为单帧耗时。
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    config = {k: v for k, v in locals().items() if k != "logger"}
+    with tempfile.TemporaryDirectory(prefix="benchmark_") as workdir, \
+            FakeOpenAIServer(latency, tts_latency, error_every) as server:
+        video_path = os.path.join(workdir, "synthetic.avi")
+        start = time.perf_counter()
+        written = make_video(video_path, seconds, fps, width, height)
+        video_seconds = time.perf_counter() - start
+
+        metrics = Metrics()
+        wall_start = time.perf_counter()
+        stats = extract_frames(video_path, folder=os.path.join(workdir, "frames"), frame_interval=frame_interval,
+                               sampling=sampling, workers=workers, metrics=metrics)
+        extraction_seconds = time.perf_counter() - wall_start
+
+        limiter = RateLimiter(base_delay=0.1, logger=logger)
+        # 每次运行使用独立的连接池，统计数据不会与之前的运行累加
+        pool = HttpPool()
+        try:
+            analyzer = ImageAnalyzer("benchmark", "alloy", base_url=server.base_url, logger=logger, request_interval=0,
+                                     tts_concurrency=tts_concurrency, rate_limiter=limiter, metrics=metrics,
+                                     http_pool=pool)
+
+            start = time.perf_counter()
+            narrations = [analysis for _, analysis in
+                          analyzer.analyze_frames(stats["frames"], concurrency=concurrency, batch_size=batch_size)]
+            analysis_seconds = time.perf_counter() - start
+
+            chunks = split_sentences(" ".join(n for n in narrations if n))
+            start = time.perf_counter()
+            audio = [a for a in analyzer._iter_speech(chunks, "alloy") if a is not None]
+            tts_seconds = time.perf_counter() - start
+            pool_stats = pool.stats()
+        finally:
+            pool.close()
+
+        start = time.perf_counter()
+        with AudioMerger(os.path.join(workdir, "narration.mp3")) as merger:
+            for segment in audio:
+                with metrics.span("audio_merge"):
+                    merger.append(segment)
+        merge_seconds = time.perf_counter() - start
+        wall_seconds = time.perf_counter() - wall_start
+        report = metrics.report()
+        # 每个请求包含 batch_size 帧，单帧耗时按每个请求的平均帧数折算
+        request_latency = report["spans"].get("vision_request")
+        frame_latency = None
+        if request_latency:
+            frames_per_request = len(narrations) / request_latency["count"]
+            frame_latency = {k: (round(value / frames_per_request, 6) if k != "count" else value)
+                             for k, value in request_latency.items()}
+
+        return {
+            "config": config,
+            "environment": {"python": platform.python_version(), "opencv": cv2.__version__,
+                            "platform": platform.platform(), "cpus": os.cpu_count()},
+            "video": {"frames": written, "generate_seconds": round(video_seconds, 3)},
+            "extraction": {"seconds": round(extraction_seconds, 3), "kept": stats["kept"],
+                           "decoded": stats["decoded"], "grabbed": stats["grabbed"],
+                           "frames_per_s": round(stats["kept"] / extraction_seconds, 2) if extraction_seconds else None},
+            "analysis": {"seconds": round(analysis_seconds, 3), "frames": len(narrations),
+                         "failed": sum(1 for n in narrations if not n), "request_latency": request_latency,
+                         "frame_latency": frame_latency,
+                         "retries": limiter.retries, "rejected": server.rejected},
+            "tts": {"seconds": round(tts_seconds, 3), "chunks": len(chunks), "segments": len(audio),
+                    "request_latency": report["spans"].get("tts_request")},
+            "merge": {"seconds": round(merge_seconds, 4), "segments": merger.segments},
+            "wall_seconds": round(wall_seconds, 3),
+            "http_pool": pool_stats,
+            "metrics": report,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线端到端基准测试")
+    parser.add_argument("--seconds", type=float, default=30, help="合成视频的长度（秒）")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--frame-interval", type=float, default=1, help="帧提取的时间间隔（秒）")
+    parser.add_argument("--sampling", default="seek", help="采样模式：seek、grab 或 read")
+    parser.add_argument("--workers", type=int, default=1, help="帧提取的进程数")
+    parser.add_argument("--concurrency", type=int, default=1, help="并发分析请求数")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次请求的帧数")
+    parser.add_argument("--tts-concurrency", type=int, default=4, help="并发语音合成请求数")
+    parser.add_argument("--latency", type=float, default=0.1, help="假服务的图像分析延迟（秒）")
+    parser.add_argument("--tts-latency", type=float, default=0.1, help="假服务的语音合成延迟（秒）")
+    parser.add_argument("--error-every", type=int, default=0, help="每 N 个请求注入一次 429，0 表示不注入")
+    parser.add_argument("--output", help="结果 JSON 文件路径，默认只打印")
+    parser.add_argument("--verbose", action="store_true", help="输出处理过程的日志")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s - %(levelname)s - %(message)s")
+    result = run_benchmark(seconds=args.seconds, fps=args.fps, width=args.width, height=args.height,
+                           frame_interval=args.frame_interval, sampling=args.sampling, workers=args.workers,
+                           concurrency=args.concurrency, batch_size=args.batch_size,
+                           tts_concurrency=args.tts_concurrency, latency=args.latency, tts_latency=args.tts_latency,
+                           error_every=args.error_every)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
@@ -1,10 +1,23 @@
 # 导入所需的库
+import argparse
 import cv2
 import time
-from PIL import Image
-import numpy as np
 import os
 
+from frame_filter import MotionGate
+from frame_ring import FrameRing, write_frame_file
+from preprocess import FramePreprocessor
+
+# 命令行参数：默认每2秒保存一帧；--motion 时只在画面有变化时保存
+parser = argparse.ArgumentParser(description="从摄像头采集帧供 narrator.py 解说")
+parser.add_argument("--interval", type=float, default=2, help="固定采样间隔（秒），默认为2")
+parser.add_argument("--motion", action="store_true", help="运动触发模式：画面有变化时才输出帧")
+parser.add_argument("--motion-threshold", type=float, default=0.03, help="运动分数阈值（0-1），默认为0.03")
+parser.add_argument("--heartbeat", type=float, default=60, help="运动触发模式下无变化时输出心跳帧的间隔（秒）")
+args = parser.parse_args()
+motion = MotionGate(threshold=args.motion_threshold, heartbeat=args.heartbeat,
+                    min_interval=min(1.0, args.interval), idle_interval=args.interval) if args.motion else None
+
 # 设置保存帧的文件夹名称
 folder = "frames"
 
@@ -12,6 +25,16 @@ folder = "frames"
 frames_dir = os.path.join(os.getcwd(), folder)
 os.makedirs(frames_dir, exist_ok=True)
 
+# 帧预处理：最长边250像素的 JPEG
+preprocessor = FramePreprocessor(max_edge=250)
+
+# 优先通过共享内存把帧交给解说进程；共享内存不可用时退回到写文件
+try:
+    ring = FrameRing.create()
+except OSError as e:
+    print(f"无法创建共享内存帧缓冲区（{e}），改为写入 {folder} 目录。")
+    ring = None
+
 # 初始化摄像头
 cap = cv2.VideoCapture(0)
 
@@ -23,31 +46,34 @@ if not cap.isOpened():
 time.sleep(2)
 
 # 使用一个无限循环来不断地从摄像头读取帧
-while True:
-    ret, frame = cap.read()
-    if ret:
-        # 将捕获的帧转换成PIL图像格式
-        pil_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-
-        # 调整图像大小
-        max_size = 250
-        ratio = max_size / max(pil_img.size)
-        new_size = tuple([int(x*ratio) for x in pil_img.size])
-        resized_img = pil_img.resize(new_size, Image.LANCZOS)
-
-        # 将PIL图像转换回OpenCV图像格式
-        frame = cv2.cvtColor(np.array(resized_img), cv2.COLOR_RGB2BGR)
-
-        # 将帧作为图像文件保存
-        print("📸 正在保存帧。！")
-        path = f"{folder}/frame.jpg"
-        cv2.imwrite(path, frame)
-    else:
-        print("捕获图像失败")
-
-    # 等待2秒
-    time.sleep(2)
-
-# 释放摄像头并关闭所有窗口
-cap.release()
-cv2.destroyAllWindows()
+try:
+    while True:
+        ret, frame = cap.read()
+        if ret:
+            if motion is not None:
+                emit, score, reason = motion.check(frame)
+                if not emit:
+                    time.sleep(motion.interval)
+                    continue
+                print(f"🏃 运动分数 {score:.3f}（{reason}），下次采样间隔 {motion.interval:.1f} 秒")
+
+            # 调整图像大小并编码
+            image, info = preprocessor.process(frame)
+
+            print("📸 正在保存帧。！")
+            if ring is not None:
+                ring.write(image)
+            else:
+                # 将帧作为图像文件保存
+                write_frame_file(f"{folder}/frame{preprocessor.extension}", image)
+        else:
+            print("捕获图像失败")
+
+        # 等待下一次采样
+        time.sleep(motion.interval if motion is not None else args.interval)
+finally:
+    # 释放摄像头并关闭所有窗口
+    if ring is not None:
+        ring.close()
+    cap.release()
+    cv2.destroyAllWindows()
@@ -0,0 +1,116 @@
+# coding: utf-8
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# 缓存模式：
+# - "use": 命中时直接返回缓存结果，未命中时写入
+# - "refresh": 不读取缓存，但用新结果覆盖旧条目
+# - "bypass": 完全不使用缓存
+CACHE_MODES = ("use", "refresh", "bypass")
+
+
+def content_key(*parts):
+    """用各部分内容（字节或字符串）计算缓存键。"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # 写入长度前缀，避免不同的分段拼接出相同的内容
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ContentCache:
+    """
+    基于 SQLite 的内容寻址缓存。
+
+    按最近使用时间淘汰：超过 max_age 秒未使用的条目会被删除，条目数或总字节数超出上限时
+    删除最久未使用的条目。可在多个线程间共享。
+    """
+
+    def __init__(self, path, max_entries=20000, max_bytes=512 * 1024 * 1024, max_age=30 * 24 * 3600,
+                 mode="use", logger=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"未知的缓存模式: {mode}")
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.mode = mode
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS cache_last_used ON cache (last_used)")
+        self._conn.commit()
+
+    def get(self, key):
+        """返回缓存的字节内容，未命中或模式不允许读取时返回 None。"""
+        if self.mode != "use":
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value, last_used FROM cache WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.max_age:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE cache SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        """写入字节内容并按需淘汰旧条目。"""
+        if self.mode == "bypass":
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, sqlite3.Binary(value), len(value), now, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._conn.execute("DELETE FROM cache WHERE last_used < ?", (now - self.max_age,))
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        # 从最久未使用的条目开始删除，直到回到上限以内
+        removed = 0
+        for key, size in self._conn.execute("SELECT key, size FROM cache ORDER BY last_used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            removed += 1
+        self.logger.info(f"缓存 {os.path.basename(self.path)} 淘汰了 {removed} 个条目。")
+
+    def stats(self):
+        """返回命中/未命中计数和当前条目数、总字节数。"""
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
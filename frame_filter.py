@@ -0,0 +1,250 @@
+# coding: utf-8
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+# 差值哈希（dHash）的尺寸：缩放到 (HASH_SIZE + 1) x HASH_SIZE 的灰度图，比较相邻像素得到 HASH_SIZE² 位
+HASH_SIZE = 8
+
+
+def list_frames(frames_dir):
+    """
+    按帧序号列出目录中的帧图像，返回与 extract_frames 相同格式的记录（timestamp 未知时为 None）。
+    """
+    records = []
+    for filename in os.listdir(frames_dir):
+        name, ext = os.path.splitext(filename)
+        if ext.lower() not in ('.png', '.jpg', '.jpeg', '.webp'):
+            continue
+        try:
+            index = int(name.rsplit('_', 1)[-1])
+        except ValueError:
+            index = None
+        records.append({"index": index, "timestamp": None, "path": os.path.join(frames_dir, filename)})
+    records.sort(key=lambda r: (r["index"] is None, r["index"] if r["index"] is not None else 0, r["path"]))
+    return records
+
+
+def _thumbnails(paths, size):
+    """读取图像并缩放为 size (宽, 高) 的灰度缩略图，返回形状为 (N, 高, 宽) 的 float32 数组。"""
+    thumbs = np.empty((len(paths), size[1], size[0]), dtype=np.float32)
+    for i, path in enumerate(paths):
+        gray = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise IOError(f"无法读取图像: {path}")
+        thumbs[i] = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+    return thumbs
+
+
+def _dhash(thumbs):
+    return (thumbs[:, :, 1:] > thumbs[:, :, :-1]).reshape(len(thumbs), -1)
+
+
+def dhash_bits(paths):
+    """批量计算差值哈希，返回形状为 (N, HASH_SIZE²) 的布尔数组。"""
+    return _dhash(_thumbnails(paths, (HASH_SIZE + 1, HASH_SIZE)))
+
+
+class DedupGate:
+    """
+    流式去重：逐帧判断是否与上一个保留帧近似重复，规则与 dedup_frames 相同。
+
+    丢弃帧的时间戳同样记录到上一个保留帧的 "covered" 列表中。保留帧的记录可能已经交给下游处理，
+    列表会在原记录上继续追加，直到出现下一个保留帧。
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self.kept_bits = None
+        self.kept = None  # 上一个保留帧的记录
+        self.skipped = 0
+
+    def is_duplicate(self, frame):
+        """
+        frame 为 iter_frames 产出的帧记录（image 为编码后的图像字节）。
+
+        重复时把该帧的时间戳追加到上一个保留帧的 "covered" 列表并返回 True，否则记为新的保留帧并返回 False。
+        """
+        gray = cv2.imdecode(np.frombuffer(frame["image"], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        if gray is None:
+            raise IOError("无法解码图像")
+        thumb = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+        bits = _dhash(thumb[np.newaxis])[0]
+        if self.kept_bits is not None:
+            similarity = 1.0 - np.count_nonzero(bits != self.kept_bits) / bits.size
+            if similarity >= self.threshold:
+                self.kept.setdefault("covered", []).append(frame["timestamp"])
+                self.skipped += 1
+                return True
+        self.kept_bits = bits
+        self.kept = frame
+        return False
+
+
+def dedup_frames(frames, threshold=0.9, remove=False, logger=None):
+    """
+    去除相邻的近似重复帧。
+
+    每帧与上一个保留帧比较差值哈希，相似度（相同位的比例）不低于 threshold 时丢弃该帧，
+    并将其时间戳记录到保留帧的 "covered" 列表中，这样丢弃的帧仍可对应到时间轴上。
+
+    参数:
+    - frames: extract_frames 返回的帧记录列表，或帧图像所在目录。
+    - threshold: 相似度阈值（0-1），默认为0.9；设为大于1的值可关闭去重。
+    - remove: 是否删除被丢弃帧的图像文件。
+    - logger: 日志记录器，默认为当前模块的记录器。
+
+    返回:
+    - 保留的帧记录列表（按时间顺序）。
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    if isinstance(frames, str):
+        frames = list_frames(frames)
+    if not frames:
+        return []
+
+    bits = dhash_bits([f["path"] for f in frames])
+    # 与上一个保留帧的相似度需要顺序比较，但每次比较都是整条哈希的向量运算
+    kept = []
+    kept_bits = None
+    for frame, frame_bits in zip(frames, bits):
+        if kept_bits is not None:
+            similarity = 1.0 - np.count_nonzero(frame_bits != kept_bits) / frame_bits.size
+            if similarity >= threshold:
+                kept[-1].setdefault("covered", []).append(frame["timestamp"])
+                if remove:
+                    os.remove(frame["path"])
+                continue
+        kept.append(dict(frame))
+        kept_bits = frame_bits
+
+    logger.info(f"相似帧去重完成：共 {len(frames)} 帧，跳过 {len(frames) - len(kept)} 帧，保留 {len(kept)} 帧。")
+    return kept
+
+
+def frame_descriptor(frame, size=(16, 9), bins=(8, 4)):
+    """
+    计算一帧 BGR 图像的廉价描述子，用于比较画面之间的差异。
+
+    由缩小的灰度图和 HSV 色相-饱和度直方图两部分组成，各自归一化到欧氏距离不超过1，
+    因此两个描述子的距离同时反映构图和色彩的变化。
+
+    参数:
+    - size: 灰度缩略图的尺寸 (宽, 高)。
+    - bins: 色相和饱和度的直方图分箱数。
+
+    返回:
+    - 一维 float32 数组。
+    """
+    small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).astype(np.float32).ravel()
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    hist = cv2.calcHist([hsv], [0, 1], None, list(bins), [0, 180, 0, 256]).ravel()
+    hist /= max(float(hist.sum()), 1.0)
+    return np.concatenate([gray / (255.0 * np.sqrt(gray.size)), hist / np.sqrt(2.0)]).astype(np.float32)
+
+
+def select_diverse(descriptors, k, timestamps=None, time_weight=0.25):
+    """
+    用贪心 k-center（最远点采样）从候选帧中选出 k 个最有代表性且彼此差异最大的帧。
+
+    从第一帧开始，每次选择与已选帧的最小距离最大的候选帧，使每个候选帧都与某个已选帧足够接近。
+    给出 timestamps 时把归一化的时间（乘以 time_weight）作为一维特征，长时间画面不变的片段也能分到少量帧。
+
+    参数:
+    - descriptors: 形状为 (N, D) 的描述子数组，如 frame_descriptor 的结果。
+    - k: 需要选出的帧数。
+    - timestamps: 可选的候选帧时间（秒）。
+    - time_weight: 时间特征的权重，0 表示只看画面内容。
+
+    返回:
+    - (按时间顺序排列的候选帧下标列表, 覆盖半径)，覆盖半径为候选帧到最近已选帧的最大距离。
+    """
+    points = np.asarray(descriptors, dtype=np.float32)
+    if len(points) == 0 or k <= 0:
+        return [], 0.0
+    if timestamps is not None and time_weight:
+        times = np.asarray(timestamps, dtype=np.float32)
+        span = float(times.max() - times.min()) or 1.0
+        points = np.hstack([points, (time_weight * (times - times.min()) / span)[:, np.newaxis]])
+    if k >= len(points):
+        return list(range(len(points))), 0.0
+    chosen = [0]
+    # 每个候选帧到已选帧的最小距离，每选一帧只需与新选的帧比较一次
+    distances = np.linalg.norm(points - points[0], axis=1)
+    for _ in range(k - 1):
+        index = int(distances.argmax())
+        chosen.append(index)
+        distances = np.minimum(distances, np.linalg.norm(points - points[index], axis=1))
+    return sorted(chosen), float(distances.max())
+
+
+class MotionGate:
+    """
+    运动触发：在缩小的灰度图上做帧差，画面变化超过阈值时才放行，并据此调整采样间隔。
+
+    运动分数为当前帧与上一个放行帧逐像素差值的平均值（0-1）。分数不低于 threshold 且距上次放行
+    不少于 min_interval 秒时放行；长时间没有运动时每 heartbeat 秒放行一帧作为心跳。
+    最近 cooldown 秒内检测到运动（与上一次检测的帧相比）时按 active_interval 采样，否则逐步放慢到 idle_interval。
+    """
+
+    def __init__(self, threshold=0.03, min_interval=1.0, heartbeat=60.0, active_interval=0.5, idle_interval=2.0,
+                 cooldown=5.0, width=64):
+        self.threshold = threshold
+        self.min_interval = min_interval
+        self.heartbeat = heartbeat
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.cooldown = cooldown
+        self.width = width
+        self.interval = idle_interval  # 下一次采样前的等待时间（秒）
+        self.skipped = 0
+        self._kept = None
+        self._previous = None
+        self._kept_at = None
+        self._moved_at = None
+
+    def _small_gray(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        height = max(1, round(gray.shape[0] * self.width / gray.shape[1]))
+        small = cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+        # 模糊去掉传感器噪声，避免静止画面产生误触发
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    @staticmethod
+    def _score(a, b):
+        return float(cv2.absdiff(a, b).mean()) / 255.0
+
+    def check(self, frame, now=None):
+        """
+        检查一帧 BGR 图像，返回 (是否放行, 运动分数, 原因)，原因为 "first"、"motion"、"heartbeat" 或 None。
+        """
+        now = time.monotonic() if now is None else now
+        small = self._small_gray(frame)
+        if self._previous is not None and self._score(small, self._previous) >= self.threshold:
+            self._moved_at = now
+        self._previous = small
+
+        if self._moved_at is not None and now - self._moved_at < self.cooldown:
+            self.interval = self.active_interval
+        else:
+            self.interval = min(self.idle_interval, self.interval * 2)
+
+        if self._kept is None:
+            reason, score = "first", 1.0
+        else:
+            score = self._score(small, self._kept)
+            since = now - self._kept_at
+            if score >= self.threshold and since >= self.min_interval:
+                reason = "motion"
+            elif since >= self.heartbeat:
+                reason = "heartbeat"
+            else:
+                self.skipped += 1
+                return False, score, None
+        self._kept = small
+        self._kept_at = now
+        return True, score, reason
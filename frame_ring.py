@@ -0,0 +1,139 @@
+# coding: utf-8
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+# 摄像头采集与解说进程共享的环形缓冲区名称
+FRAME_RING_NAME = "video_gui_frames"
+
+# 头部：魔数、槽数、每槽最大字节数、最新帧的序号
+_HEADER = struct.Struct("<4sIIQ")
+# 每个槽的头部：帧序号、采集时间（time.time()）、图像字节数
+_SLOT = struct.Struct("<QdI4x")
+_MAGIC = b"FRNG"
+
+
+class FrameRing:
+    """
+    基于共享内存的最近帧环形缓冲区，一个写入进程、任意多个读取进程。
+
+    每个槽记录帧序号和采集时间。写入时先把槽的序号清零，写完图像后再写入序号并更新头部的最新序号；
+    读取时在复制前后各检查一次槽的序号，两次都等于期望值才说明读到的是完整的帧，不会读到写了一半的图像。
+    通过 create 创建（写入方）或 attach 连接（读取方），不要直接调用构造函数。
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self.owner = owner
+        magic, self.slots, self.slot_size, _ = _HEADER.unpack_from(shm.buf, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"共享内存 {shm.name} 不是帧缓冲区")
+
+    @classmethod
+    def create(cls, name=FRAME_RING_NAME, slots=4, slot_size=256 * 1024):
+        """创建缓冲区；同名的旧缓冲区（例如上次异常退出后残留的）会被替换。"""
+        size = _HEADER.size + slots * (_SLOT.size + slot_size)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _HEADER.pack_into(shm.buf, 0, _MAGIC, slots, slot_size, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=FRAME_RING_NAME):
+        """连接已存在的缓冲区，不存在时抛出 FileNotFoundError。"""
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == "posix" and sys.version_info < (3, 13):
+            # 读取方不拥有这块内存，避免 resource_tracker 在本进程退出时把它删除
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    def _slot_offset(self, seq):
+        return _HEADER.size + (seq % self.slots) * (_SLOT.size + self.slot_size)
+
+    @property
+    def latest_seq(self):
+        """最新一帧的序号，还没有写入任何帧时为 0。"""
+        return _HEADER.unpack_from(self._shm.buf, 0)[3]
+
+    def write(self, image, timestamp=None):
+        """写入一帧图像字节，返回它的序号。"""
+        if len(image) > self.slot_size:
+            raise ValueError(f"图像大小 {len(image)} 字节超过槽容量 {self.slot_size} 字节")
+        buf = self._shm.buf
+        seq = self.latest_seq + 1
+        offset = self._slot_offset(seq)
+        _SLOT.pack_into(buf, offset, 0, 0.0, 0)
+        start = offset + _SLOT.size
+        buf[start:start + len(image)] = image
+        _SLOT.pack_into(buf, offset, seq, time.time() if timestamp is None else timestamp, len(image))
+        _HEADER.pack_into(buf, 0, _MAGIC, self.slots, self.slot_size, seq)
+        return seq
+
+    def read(self, seq):
+        """读取序号为 seq 的帧，返回 (图像字节, 采集时间)；该槽已被覆盖或正在写入时返回 None。"""
+        buf = self._shm.buf
+        offset = self._slot_offset(seq)
+        slot_seq, timestamp, length = _SLOT.unpack_from(buf, offset)
+        if slot_seq != seq:
+            return None
+        start = offset + _SLOT.size
+        image = bytes(buf[start:start + length])
+        if _SLOT.unpack_from(buf, offset)[0] != seq:
+            return None
+        return image, timestamp
+
+    def latest(self):
+        """返回最新一帧的 (序号, 图像字节, 采集时间)，还没有帧时返回 None。"""
+        while True:
+            seq = self.latest_seq
+            if seq == 0:
+                return None
+            frame = self.read(seq)
+            if frame is not None:
+                return (seq,) + frame
+
+    def wait(self, after=0, timeout=None, poll_interval=0.01):
+        """
+        等待序号大于 after 的新帧，返回最新一帧的 (序号, 图像字节, 采集时间)；超时返回 None。
+
+        只检查共享内存头部的序号，不访问文件系统。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.latest_seq <= after:
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.latest()
+
+    def close(self):
+        """断开连接；写入方同时删除缓冲区。"""
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_frame_file(path, image):
+    """先写入临时文件再原子替换，读取方不会读到写了一半的图像。"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(image)
+    while True:
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows 上目标文件正被读取时无法替换，稍等后重试
+            time.sleep(0.05)
@@ -1,36 +1,75 @@
 # coding: utf-8
+import importlib
 import os
 import tkinter as tk
 from tkinter import filedialog, messagebox, scrolledtext
 from tkinter import ttk
 import logging
-import pyperclip
+import queue
+import threading
 
-import pygame
 from ttkthemes import ThemedTk
 
-from video_narrator import ImageAnalyzer
-from videos import extract_frames
+from content_cache import CACHE_MODES, ContentCache
+from preprocess import CODECS, DETAILS, FramePreprocessor
+from rate_limit import RateLimiter
 
-pygame.mixer.init()
+# 处理时才需要的模块（依赖 cv2、numpy、openai 等）。窗口显示后在后台线程中预先导入，
+# 启动时不加载，点击"开始处理"时也不必再等待导入
+WARM_UP_MODULES = ("videos", "frame_filter", "video_narrator", "pipeline", "metrics")
 
 
 class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
+    """
+    日志记录先放入队列，由 Tk 主线程定时批量写入文本框，文本框最多保留 max_lines 行。
+
+    可以在任意线程中记录日志，界面不会因为逐条刷新而卡顿。
+    """
+
+    def __init__(self, text_widget, max_lines=1000, flush_interval=100, batch_size=500):
         super().__init__()
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.flush_interval = flush_interval  # 刷新间隔（毫秒）
+        self.batch_size = batch_size  # 每次刷新最多写入的记录数
+        self.records = queue.Queue()
+        self.text_widget.after(self.flush_interval, self._drain)
 
     def emit(self, record):
-        msg = self.format(record)
-        self.text_widget.configure(state='normal')
-        self.text_widget.insert(tk.END, msg + '\n')
-        self.text_widget.configure(state='disabled')
-        self.text_widget.yview(tk.END)
+        try:
+            self.records.put_nowait(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def _drain(self):
+        lines = []
+        while len(lines) < self.batch_size:
+            try:
+                lines.append(self.records.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.text_widget.configure(state='normal')
+            self.text_widget.insert(tk.END, '\n'.join(lines) + '\n')
+            # 删除超出上限的最早的行
+            excess = int(self.text_widget.index('end-1c').split('.')[0]) - 1 - self.max_lines
+            if excess > 0:
+                self.text_widget.delete('1.0', f'{excess + 1}.0')
+            self.text_widget.configure(state='disabled')
+            self.text_widget.yview(tk.END)
+        self.text_widget.after(self.flush_interval, self._drain)
 
 
 class VideoProcessorUI:
     def __init__(self, root):
         self.root = root
+        self.analyzer = None
+        self.pipeline = None
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.rate_limiter = RateLimiter(logger=logger)  # 所有任务共享，额度信息跨任务保留
+        self.progress = None  # (已完成数, 总数)，由处理线程更新，主线程定时读取
+        self.error = None
         self.configure_ui()
         self.create_widgets()
 
@@ -61,7 +100,9 @@ class VideoProcessorUI:
         self.create_input_widgets()
 
     def create_input_widgets(self):
-        labels = ["帧提取的时间间隔（秒）:", "视频文件路径:", "OpenAI API密钥:", "语音ID:", "OpenAI API的基本URL（可选）:", "语言设定:"]
+        labels = ["帧提取的时间间隔（秒）:", "视频文件路径:", "OpenAI API密钥:", "语音ID:", "OpenAI API的基本URL（可选）:", "语言设定:",
+                  "相似帧去重阈值（0-1，可选）:", "并发分析请求数（可选）:",
+                  "每次请求的帧数（可选）:", "图像最长边（像素，可选）:", "图像格式:", "图像细节:", "缓存:"]
         self.entries = {}
         for i, label in enumerate(labels):
             ttk.Label(self.input_frame, text=label).grid(row=i, column=0, padx=5, pady=5, sticky=tk.W)
@@ -72,6 +113,19 @@ class VideoProcessorUI:
                 self.voice_dropdown = ttk.Combobox(self.input_frame, textvariable=self.voice_var, values=self.voice_options)
                 self.voice_dropdown.grid(row=i, column=1, padx=5, pady=5, sticky=(tk.W, tk.E))
                 self.entries[label] = self.voice_var
+            elif label == "缓存:":
+                # 分析结果和合成音频的缓存模式。use: 使用缓存；refresh: 重新请求并更新缓存；bypass: 不使用缓存
+                self.cache_var = tk.StringVar(value=CACHE_MODES[0])
+                ttk.Combobox(self.input_frame, textvariable=self.cache_var, values=CACHE_MODES,
+                             state="readonly").grid(row=i, column=1, padx=5, pady=5, sticky=(tk.W, tk.E))
+                self.entries[label] = self.cache_var
+            elif label in ("图像格式:", "图像细节:"):
+                # 帧的编码格式和图像分析接口的 detail 参数
+                values = tuple(CODECS) if label == "图像格式:" else DETAILS
+                var = tk.StringVar(value=values[0])
+                ttk.Combobox(self.input_frame, textvariable=var, values=values,
+                             state="readonly").grid(row=i, column=1, padx=5, pady=5, sticky=(tk.W, tk.E))
+                self.entries[label] = var
             elif label == "语言设定:":
                 self.language_entry = ttk.Entry(self.input_frame)
                 self.language_entry.grid(row=i, column=1, padx=5, pady=5, sticky=(tk.W, tk.E))
@@ -84,40 +138,204 @@ class VideoProcessorUI:
 
         ttk.Button(self.input_frame, text="浏览...", command=self.browse_video).grid(row=1, column=2, padx=5, pady=5,
                                                                                      sticky=tk.W)
-        ttk.Button(self.input_frame, text="开始处理", command=self.start_processing).grid(row=7, column=0, columnspan=3,
-                                                                                          padx=5, pady=5)
+        self.streaming_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.input_frame, text="流式处理（边提取边分析，帧不写入磁盘）",
+                        variable=self.streaming_var).grid(row=len(labels), column=1, padx=5, pady=5, sticky=tk.W)
+        self.play_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.input_frame, text="边生成边播放",
+                        variable=self.play_var).grid(row=len(labels), column=2, padx=5, pady=5, sticky=tk.W)
+
+        self.start_button = ttk.Button(self.input_frame, text="开始处理", command=self.start_processing)
+        self.start_button.grid(row=len(labels) + 1, column=0, padx=5, pady=5)
+        self.cancel_button = ttk.Button(self.input_frame, text="取消", command=self.cancel_processing, state='disabled')
+        self.cancel_button.grid(row=len(labels) + 1, column=2, padx=5, pady=5, sticky=tk.W)
+        self.progress_bar = ttk.Progressbar(self.input_frame, mode='determinate')
+        self.progress_bar.grid(row=len(labels) + 1, column=1, padx=5, pady=5, sticky=(tk.W, tk.E))
         self.copy_button = ttk.Button(self.input_frame, text="复制解说词", command=self.copy_latest_audio_content)
-        self.copy_button.grid(row=8, column=0, columnspan=3, padx=5, pady=5)
+        self.copy_button.grid(row=len(labels) + 2, column=0, columnspan=3, padx=5, pady=5)
 
+        self.status = tk.StringVar()
+        ttk.Label(self.input_frame, textvariable=self.status).grid(row=len(labels) + 3, column=1, padx=5, pady=5,
+                                                                   sticky=tk.W)
         self.audio_path = tk.StringVar()  # 使用StringVar来动态更新标签内容
         audio_path_label = ttk.Label(self.input_frame, textvariable=self.audio_path)
-        audio_path_label.grid(row=9, column=1, padx=5, pady=5, sticky=tk.W)
+        audio_path_label.grid(row=len(labels) + 4, column=1, padx=5, pady=5, sticky=tk.W)
 
     def start_processing(self):
+        if self.worker is not None and self.worker.is_alive():
+            return
         try:
-            frame_interval = float(self.entries["帧提取的时间间隔（秒）:"].get())
-            video_path = self.entries["视频文件路径:"].get()
-            openai_api_key = self.entries["OpenAI API密钥:"].get()
-            voice_id = self.entries["语音ID:"].get()
-            base_url = self.entries["OpenAI API的基本URL（可选）:"].get() if self.entries[
-                "OpenAI API的基本URL（可选）:"].get() else None
-            language = self.entries["语言设定:"].get() if self.entries["语言设定:"].get() else "中文"
+            # Tk 控件只能在主线程中读取，先收集全部参数再交给处理线程
+            params = {
+                "frame_interval": float(self.entries["帧提取的时间间隔（秒）:"].get()),
+                "video_path": self.entries["视频文件路径:"].get(),
+                "openai_api_key": self.entries["OpenAI API密钥:"].get(),
+                "voice_id": self.entries["语音ID:"].get(),
+                "base_url": self.entries["OpenAI API的基本URL（可选）:"].get() or None,
+                "language": self.entries["语言设定:"].get() or "中文",
+                "dedup_threshold": float(self.entries["相似帧去重阈值（0-1，可选）:"].get() or 0) or None,
+                "concurrency": int(self.entries["并发分析请求数（可选）:"].get() or 1),
+                "batch_size": int(self.entries["每次请求的帧数（可选）:"].get() or 1),
+                "max_edge": int(self.entries["图像最长边（像素，可选）:"].get() or 250),
+                "codec": self.entries["图像格式:"].get(),
+                "detail": self.entries["图像细节:"].get(),
+                "cache_mode": self.entries["缓存:"].get(),
+                "streaming": self.streaming_var.get(),
+                "play": self.play_var.get(),
+            }
+        except ValueError as e:
+            messagebox.showerror("错误", f"参数格式不正确: {e}")
+            return
 
-            logger.info("开始处理视频...")
-            extract_frames(video_path=video_path, frame_interval=frame_interval)
-            logger.info("视频帧提取完成")
-            logger.info("开始处理帧图像...")
-            self.analyzer = ImageAnalyzer(openai_api_key=openai_api_key,
-                                          voice_id=voice_id,
-                                          base_url=base_url,
+        self.cancel_event.clear()
+        self.progress = None
+        self.error = None
+        self.audio_path.set("")
+        self.status.set("处理中...")
+        self.progress_bar.configure(mode='indeterminate')
+        self.progress_bar.start(50)
+        self.start_button.configure(state='disabled')
+        self.cancel_button.configure(state='normal')
+        self.worker = threading.Thread(target=self._process, args=(params,), daemon=True)
+        self.worker.start()
+        self.root.after(200, self._poll_worker)
+
+    def _on_progress(self, done, total):
+        # 在处理线程中调用，只记录数据，界面由 _poll_worker 在主线程更新
+        self.progress = (done, total)
+
+    def warm_up(self):
+        """在后台线程中导入处理模块，不阻塞界面。"""
+        def run():
+            for name in WARM_UP_MODULES:
+                try:
+                    importlib.import_module(name)
+                except Exception as e:
+                    logger.error(f"预加载模块 {name} 时发生错误: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _process(self, params):
+        """在后台线程中执行提取、分析和语音合成。"""
+        from frame_filter import dedup_frames
+        from metrics import Metrics
+        from pipeline import StreamingPipeline
+        from video_narrator import ImageAnalyzer
+        from videos import extract_frames
+
+        cache = audio_cache = player = None
+        try:
+            # 并发时每个请求只附带最近几条解说
+            context_size = 5 if params["concurrency"] > 1 else None
+            cache_mode = params["cache_mode"]
+            cache = ContentCache(os.path.join(os.getcwd(), "cache", "analysis.sqlite3"), mode=cache_mode, logger=logger)
+            audio_cache = ContentCache(os.path.join(os.getcwd(), "cache", "tts.sqlite3"), mode=cache_mode,
+                                       max_bytes=2 * 1024 * 1024 * 1024, logger=logger)
+            metrics = Metrics()  # 本次运行各阶段的耗时和用量，处理结束时导出到 metrics 目录
+            preprocessor = FramePreprocessor(max_edge=params["max_edge"], codec=params["codec"],
+                                             detail=params["detail"])
+
+            self.analyzer = ImageAnalyzer(openai_api_key=params["openai_api_key"],
+                                          voice_id=params["voice_id"],
+                                          base_url=params["base_url"],
                                           logger=logger,
-                                          language=language)
-            self.analyzer.main(voice=voice_id)
-            self.audio_path.set(self.analyzer.get_latest_audio_path())  # 更新标签内容为最新的音频文件路径
+                                          language=params["language"],
+                                          cache=cache,
+                                          audio_cache=audio_cache,
+                                          # 由限流器按接口返回的额度控制请求速度，不再固定等待
+                                          request_interval=0,
+                                          rate_limiter=self.rate_limiter,
+                                          image_detail=params["detail"],
+                                          metrics=metrics)
+            self.analyzer.cancel_event = self.cancel_event
+            self.analyzer.progress_callback = self._on_progress
+            logger.info("开始处理视频...")
+            if params["streaming"]:
+                player = self._audio_player() if params["play"] else None
+                self.pipeline = StreamingPipeline(self.analyzer,
+                                                  dedup_threshold=params["dedup_threshold"],
+                                                  concurrency=params["concurrency"],
+                                                  context_size=context_size,
+                                                  batch_size=params["batch_size"],
+                                                  preprocessor=preprocessor,
+                                                  player=player,
+                                                  logger=logger)
+                self.pipeline.run(params["video_path"], frame_interval=params["frame_interval"],
+                                  voice=params["voice_id"])
+            else:
+                stats = extract_frames(video_path=params["video_path"], frame_interval=params["frame_interval"],
+                                       cancel_event=self.cancel_event, preprocessor=preprocessor,
+                                       metrics=metrics)
+                logger.info("视频帧提取完成")
+                frames = stats["frames"]
+                if params["dedup_threshold"]:
+                    frames = dedup_frames(frames, threshold=params["dedup_threshold"], logger=logger)
+                if self.cancel_event.is_set():
+                    return
+                logger.info("开始处理帧图像...")
+                self.analyzer.main(voice=params["voice_id"], frames=frames, concurrency=params["concurrency"],
+                                   context_size=context_size, batch_size=params["batch_size"])
             logger.info("帧图像处理完成")
         except Exception as e:
             logger.error(f"处理过程中发生错误: {e}")
-            messagebox.showerror("错误", f"处理过程中发生错误: {e}")
+            self.error = e
+        finally:
+            self.pipeline = None
+            # 每次运行结束都释放数据库连接和播放线程，长时间使用界面时不会越积越多
+            if player is not None:
+                player.stop()
+            for c in (cache, audio_cache):
+                if c is not None:
+                    c.close()
+
+    def _audio_player(self):
+        # 音频设备在第一次需要播放时才初始化
+        import pygame
+        from playback import AudioPlayer
+
+        return AudioPlayer(pygame.mixer, logger)
+
+    def _poll_worker(self):
+        if self.progress is not None:
+            done, total = self.progress
+            if total:
+                self.progress_bar.stop()
+                self.progress_bar.configure(mode='determinate', maximum=total, value=done)
+                self.status.set(f"已分析 {done}/{total} 帧")
+            else:
+                self.status.set(f"已分析 {done} 帧")
+        if self.worker.is_alive():
+            self.root.after(200, self._poll_worker)
+            return
+
+        self.progress_bar.stop()
+        self.start_button.configure(state='normal')
+        self.cancel_button.configure(state='disabled')
+        if self.error is not None:
+            self.status.set("处理失败")
+            messagebox.showerror("错误", f"处理过程中发生错误: {self.error}")
+        elif self.cancel_event.is_set():
+            self.status.set("已取消")
+        else:
+            self.status.set("处理完成")
+            self.audio_path.set(self.analyzer.get_latest_audio_path())  # 更新标签内容为最新的音频文件路径
+
+    def cancel_processing(self):
+        self.cancel_event.set()
+        pipeline = self.pipeline
+        if pipeline is not None:
+            pipeline.cancel()
+        self.status.set("正在取消...")
+        logger.info("正在取消处理...")
+
+    def copy_latest_audio_content(self):
+        if self.analyzer is None or not self.analyzer.ai_message:
+            messagebox.showinfo("提示", "还没有生成解说词。")
+            return
+        import pyperclip
+
+        pyperclip.copy(self.analyzer.ai_message)
+        logger.info("解说词已复制到剪贴板。")
 
     def browse_video(self):
         filepath = filedialog.askopenfilename(
@@ -133,9 +351,22 @@ class VideoProcessorUI:
 
 # 配置日志
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
 formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-root = ThemedTk(theme="aqua")
-app = VideoProcessorUI(root)
-root.mainloop()
+
+def main():
+    """创建窗口并进入主循环。导入本模块本身没有副作用。"""
+    logger.setLevel(logging.INFO)
+    root = ThemedTk(theme="aqua")
+    app = VideoProcessorUI(root)
+    # 窗口显示后再预加载处理模块
+    root.after(100, app.warm_up)
+    root.mainloop()
+
+
+if __name__ == "__main__":
+    # 打包后的程序中，帧提取的 spawn 子进程需要由此进入
+    import multiprocessing
+
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,100 @@
+# coding: utf-8
+import importlib.util
+import logging
+import threading
+
+import httpx
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class HttpPool:
+    """
+    可在多个 OpenAI 客户端间共享的 httpx 连接池，图像分析和语音合成请求复用已建立的连接（keep-alive），
+    启用 HTTP/2 时多个请求在同一连接上并发传输，不必为每个请求重新握手。
+
+    通过 httpcore 的 trace 扩展统计请求数、进行中的请求数、新建连接数和 TLS 握手次数。
+
+    参数:
+    - http2: 是否启用 HTTP/2（需要安装 h2，未安装时退回 HTTP/1.1）；服务端不支持时自动使用 HTTP/1.1。
+    - max_connections: 最大连接数。
+    - max_keepalive: 保持空闲的最大连接数。
+    - keepalive_expiry: 空闲连接的保留时间（秒）。
+    - timeout: 请求超时（秒），与 OpenAI 客户端的默认值相同。
+    - connect_timeout: 建立连接的超时（秒）。
+    """
+
+    def __init__(self, http2=True, max_connections=20, max_keepalive=10, keepalive_expiry=30.0, timeout=600.0,
+                 connect_timeout=5.0, logger=None):
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        if http2 and importlib.util.find_spec("h2") is None:
+            self.logger.warning("未安装 h2，连接池改用 HTTP/1.1。")
+            http2 = False
+        self.http2 = http2
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self._lock = threading.Lock()
+        self.client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive,
+                                keepalive_expiry=keepalive_expiry),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            follow_redirects=True,
+            event_hooks={"request": [self._on_request]},
+        )
+
+    def _on_request(self, request):
+        request.extensions["trace"] = self._trace
+
+    def _trace(self, event, info):
+        with self._lock:
+            if event == "connection.connect_tcp.complete":
+                self.connections_opened += 1
+            elif event == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+            elif event.endswith(".send_request_headers.started"):
+                self.requests += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            elif event.endswith(".response_closed.complete") or event.endswith(".response_closed.failed"):
+                self.in_flight -= 1
+
+    def stats(self):
+        """返回连接池的使用情况：请求数、进行中的请求数及峰值、新建连接数、TLS 握手次数和当前连接状态。"""
+        connections = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = connections.connections if connections is not None else []
+        with self._lock:
+            return {
+                "http2": self.http2,
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                # 复用已有连接的请求比例
+                "reuse_ratio": round(1 - self.connections_opened / self.requests, 3) if self.requests else None,
+                "open_connections": len(connections),
+                "idle_connections": sum(1 for c in connections if c.is_idle()),
+                "http2_connections": sum(1 for c in connections if "HTTP/2" in c.info()),
+            }
+
+    def close(self):
+        self.client.close()
+
+
+def shared_pool(**options):
+    """
+    返回进程内共享的 HttpPool。第一次调用时按 options 创建，之后的调用忽略 options，
+    因此需要自定义参数时应在创建任何 ImageAnalyzer 之前调用。
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpPool(**options)
+        elif options:
+            _shared.logger.debug("共享连接池已创建，忽略新的参数。")
+        return _shared
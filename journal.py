@@ -0,0 +1,112 @@
+# coding: utf-8
+import json
+import logging
+import os
+import threading
+
+# 处理阶段，按先后顺序排列；某个阶段的配置变化时，它和之后阶段的记录都会作废
+STAGES = ("extract", "analysis", "audio")
+
+
+class Journal:
+    """
+    每个任务一个只追加的 JSON Lines 日志，记录已提取的帧、已完成的分析和已合成的音频片段，
+    进程崩溃后重新运行时跳过已完成的部分。
+
+    每条记录写入后立即 fsync；读取时忽略崩溃时写了一半的最后一行。可在多个线程间共享。
+    """
+
+    def __init__(self, path, logger=None):
+        self.path = path
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._records = []
+        if os.path.exists(path):
+            self._load()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            data = f.read()
+        valid = 0
+        for line in data.splitlines(keepends=True):
+            try:
+                self._records.append(json.loads(line))
+            except ValueError:
+                break
+            valid += len(line)
+        if valid < len(data) or (data and not data.endswith(b"\n")):
+            # 截掉崩溃时写了一半的记录，之后追加的记录才能被正确读取
+            self.logger.warning(f"忽略日志 {self.path} 中不完整的记录。")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+                if valid and not data[:valid].endswith(b"\n"):
+                    f.seek(valid)
+                    f.write(b"\n")
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, stage, record):
+        """追加一条 stage 阶段的记录。"""
+        record = dict(record, stage=stage)
+        with self._lock:
+            self._records.append(record)
+            self._write(record)
+
+    def records(self, stage):
+        """返回 stage 阶段的全部记录（不含配置记录）。"""
+        with self._lock:
+            return [r for r in self._records if r.get("stage") == stage and "config" not in r]
+
+    def begin(self, stage, config):
+        """
+        开始一个阶段：config 与日志中记录的不同时，丢弃该阶段及之后阶段的记录并写入新的配置。
+
+        返回 True 表示可以沿用日志中已有的记录。
+        """
+        config = json.loads(json.dumps(config, ensure_ascii=False))
+        with self._lock:
+            previous = next((r["config"] for r in reversed(self._records)
+                             if r.get("stage") == stage and "config" in r), None)
+            if previous == config:
+                return True
+            if previous is not None:
+                self.logger.info(f"{stage} 阶段的配置已变化，不再沿用日志中的记录。")
+            dropped = set(STAGES[STAGES.index(stage):])
+            kept = [r for r in self._records if r.get("stage") not in dropped]
+            record = {"stage": stage, "config": config}
+            if len(kept) != len(self._records):
+                self._rewrite(kept + [record])
+            else:
+                self._records.append(record)
+                self._write(record)
+            return False
+
+    def _rewrite(self, records):
+        # 先写临时文件再替换，重写过程中崩溃也不会损坏原日志
+        self._file.close()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._records = records
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,127 @@
+# coding: utf-8
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+# 导出 Prometheus 指标时的名称前缀
+PROMETHEUS_PREFIX = "video_narrator_"
+
+# 耗时直方图的桶上限（秒）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """
+    各处理阶段的耗时和用量统计，可在多个线程间共享。
+
+    span 记录一段代码的耗时（秒），汇总为直方图；count 累加计数器，用于请求数、token 数和字节数。
+    结果可导出为 JSON 报告和 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._counters = {}
+        self._durations = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        """记录 with 块的耗时，name 为阶段名称，如 "vision_request"。"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def state(self):
+        """返回可序列化的原始数据，用于在进程间传递后 merge。"""
+        with self._lock:
+            return {"counters": dict(self._counters), "durations": {k: list(v) for k, v in self._durations.items()}}
+
+    def merge(self, state):
+        """合并另一个 Metrics 的 state()，例如帧提取子进程的统计。"""
+        with self._lock:
+            for name, value in state["counters"].items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, values in state["durations"].items():
+                self._durations.setdefault(name, []).extend(values)
+
+    def report(self):
+        """返回汇总后的报告：计数器和每个阶段的次数、总耗时及分位数（秒）。"""
+        state = self.state()
+        spans = {}
+        for name, values in sorted(state["durations"].items()):
+            values = np.array(values)
+            spans[name] = {"count": len(values), "total": round(float(values.sum()), 6),
+                           "mean": round(float(values.mean()), 6),
+                           "p50": round(float(np.percentile(values, 50)), 6),
+                           "p90": round(float(np.percentile(values, 90)), 6),
+                           "p99": round(float(np.percentile(values, 99)), 6),
+                           "max": round(float(values.max()), 6)}
+        return {"started_at": self.started_at, "wall_seconds": round(time.time() - self.started_at, 3),
+                "counters": dict(sorted(state["counters"].items())), "spans": spans}
+
+    def prometheus(self):
+        """返回 Prometheus 文本格式的指标：计数器为 counter，阶段耗时为 histogram。"""
+        state = self.state()
+        lines = []
+        for name, value in sorted(state["counters"].items()):
+            metric = f"{PROMETHEUS_PREFIX}{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, values in sorted(state["durations"].items()):
+            metric = f"{PROMETHEUS_PREFIX}{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            values = np.sort(np.array(values))
+            for bucket in DURATION_BUCKETS:
+                lines.append(f'{metric}_bucket{{le="{bucket}"}} {int(np.searchsorted(values, bucket, side="right"))}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {len(values)}')
+            lines.append(f"{metric}_sum {float(values.sum())}")
+            lines.append(f"{metric}_count {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path_prefix):
+        """将报告写入 path_prefix.json 和 path_prefix.prom，返回两个文件路径。"""
+        directory = os.path.dirname(path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        json_path, prom_path = f"{path_prefix}.json", f"{path_prefix}.prom"
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+        with open(prom_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus())
+        return json_path, prom_path
+
+
+@contextmanager
+def profile(path=None):
+    """
+    可选的 cProfile 钩子：path 不为空时对 with 块做性能分析，并将结果写入 path（可用 pstats 或 snakeviz 查看）。
+
+    cProfile 只统计调用线程，线程池中执行的请求不在结果中，它们的耗时见 Metrics 的 span。
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(path)
@@ -0,0 +1,108 @@
+# coding: utf-8
+import logging
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# 一张 250 像素以内的图像按单个图块估算的 token 数
+IMAGE_TOKENS = 255
+
+SUMMARY_PREFIX = "（此前解说的摘要）"
+
+
+def _is_cjk(ch):
+    return ('\u2e80' <= ch <= '\u9fff') or ('\u3040' <= ch <= '\u30ff') or ('\uac00' <= ch <= '\ud7af') \
+        or ('\uff00' <= ch <= '\uffef')
+
+
+def estimate_tokens(text):
+    """
+    在本地粗略估算文本的 token 数：中日韩字符按每字1个 token，其余字符按每4个字符1个 token。
+    """
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_messages_tokens(messages):
+    """估算对话消息列表的 token 数，图像部分按 IMAGE_TOKENS 计。"""
+    total = 0
+    for message in messages:
+        total += MESSAGE_OVERHEAD_TOKENS
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += estimate_tokens(part["text"])
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKENS
+    return total
+
+
+def truncate_tokens(text, max_tokens):
+    """保留文本末尾不超过 max_tokens 的部分。"""
+    budget = max_tokens * 4
+    for i in range(len(text) - 1, -1, -1):
+        budget -= 4 if _is_cjk(text[i]) else 1
+        if budget < 0:
+            return text[i + 1:]
+    return text
+
+
+class NarrationContext:
+    """
+    有 token 预算的解说上下文。
+
+    保留最近 window 条解说的滑动窗口；被挤出窗口的解说每累计 summary_every 条就汇总进一段摘要。
+    提供 summarize(旧摘要, 解说列表) 时使用它生成摘要，否则（或其失败时）在本地截取末尾文本。
+    messages() 产出的上下文总是不超过 max_tokens，因此每次请求的提示词大小保持平稳。
+    """
+
+    def __init__(self, max_tokens=2000, window=8, summary_every=10, summarize=None, logger=None):
+        self.max_tokens = max_tokens
+        self.window = window
+        self.summary_every = summary_every
+        self.summarize = summarize
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.summary = ""
+        self.recent = []
+        self.pending = []
+
+    def add(self, text):
+        """加入一条新的解说。"""
+        self.recent.append(text)
+        if len(self.recent) > self.window:
+            self.pending.extend(self.recent[:-self.window])
+            self.recent = self.recent[-self.window:]
+        if len(self.pending) >= self.summary_every:
+            self._roll_up()
+
+    def _roll_up(self):
+        summary = None
+        if self.summarize is not None:
+            try:
+                summary = self.summarize(self.summary, self.pending)
+            except Exception as e:
+                self.logger.error(f"生成解说摘要时发生错误: {e}")
+        if not summary:
+            summary = " ".join([self.summary] + self.pending).strip()
+        # 摘要最多占用一半的预算
+        self.summary = truncate_tokens(summary, self.max_tokens // 2)
+        self.pending = []
+        self.logger.info(f"📝 已将较早的解说汇总为摘要（约 {estimate_tokens(self.summary)} tokens）。")
+
+    def messages(self):
+        """返回附加到请求中的上下文消息列表（新列表，可在并发请求间安全使用）。"""
+        older = " ".join([self.summary] + self.pending).strip()
+        messages = [{"role": "assistant", "content": text} for text in self.recent]
+        # 超出预算时先丢弃窗口中最早的解说
+        while messages and estimate_messages_tokens(messages) > self.max_tokens:
+            messages.pop(0)
+        if older:
+            remaining = self.max_tokens - estimate_messages_tokens(messages) - MESSAGE_OVERHEAD_TOKENS \
+                - estimate_tokens(SUMMARY_PREFIX)
+            if remaining > 0:
+                older = truncate_tokens(older, remaining)
+                messages.insert(0, {"role": "assistant", "content": SUMMARY_PREFIX + older})
+        return messages
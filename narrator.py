@@ -8,8 +8,12 @@ import simpleaudio as sa
 import errno
 from elevenlabs import generate, play, set_api_key, voices
 
-# 初始化OpenAI客户端
-client = OpenAI()
+from frame_ring import FrameRing
+from http_pool import shared_pool
+from narration_context import IMAGE_TOKENS, NarrationContext, estimate_messages_tokens
+
+# 初始化OpenAI客户端，使用共享的连接池，请求之间保持连接
+client = OpenAI(http_client=shared_pool().client)
 
 # 使用环境变量中的ElevenLabs API密钥
 set_api_key(os.environ.get("ELEVENLABS_API_KEY"))
@@ -85,19 +89,41 @@ def analyze_image(base64_image, script):
     return response_text
 
 
+# 定义一个函数，用于取得下一帧的base64编码
+def next_frame(ring, last_seq):
+    """
+    有共享内存帧缓冲区时等待比 last_seq 新的一帧，并返回 (base64编码, 序号)；
+    否则读取 capture.py 写入的帧文件。
+    """
+    if ring is None:
+        image_path = os.path.join(os.getcwd(), "./frames/frame.jpg")
+        return encode_image(image_path), last_seq
+    seq, image, timestamp = ring.wait(after=last_seq)
+    print(f"📷 取得第 {seq} 帧（{time.time() - timestamp:.2f} 秒前采集）")
+    return base64.b64encode(image).decode("utf-8"), seq
+
+
 # 主函数，循环执行图像分析和音频播放
 def main():
-    script = []
+    # 只附带最近几条解说和较早解说的摘要，提示词大小不随运行时间增长
+    context = NarrationContext(max_tokens=2000, window=8)
 
-    while True:
-        # 图片路径
-        image_path = os.path.join(os.getcwd(), "./frames/frame.jpg")
+    # 连接 capture.py 创建的共享内存帧缓冲区，没有时读取帧文件
+    try:
+        ring = FrameRing.attach()
+    except FileNotFoundError:
+        print("未找到共享内存帧缓冲区，改为读取 frames 目录中的帧文件。")
+        ring = None
+    last_seq = 0
 
-        # 获取图片的base64编码
-        base64_image = encode_image(image_path)
+    while True:
+        # 获取最新一帧的base64编码
+        base64_image, last_seq = next_frame(ring, last_seq)
 
         # 分析图像
         print("👀 David is watching...")
+        script = context.messages()
+        print(f"📏 提示词预计 {estimate_messages_tokens(script) + IMAGE_TOKENS} tokens")
         analysis = analyze_image(base64_image, script=script)
 
         print("🎙️ David says:")
@@ -106,8 +132,8 @@ def main():
         # 播放分析结果的音频
         play_audio(analysis)
 
-        # 更新对话脚本
-        script = script + [{"role": "assistant", "content": analysis}]
+        # 更新对话上下文
+        context.add(analysis)
 
         # 等待5秒钟
         time.sleep(5)
@@ -0,0 +1,216 @@
+# coding: utf-8
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+from audio_merge import AudioMerger
+from frame_filter import DedupGate
+from video_narrator import split_sentences
+from videos import iter_frames
+
+# 队列结束标记
+_DONE = object()
+
+
+class StreamingPipeline:
+    """
+    流式处理：提取 → 分析 → 语音合成 三个阶段同时运行。
+
+    阶段之间通过有界队列连接，下游处理不过来时上游会阻塞等待（背压），
+    因此长视频的内存占用保持平稳。帧只在内存中编码，除非指定 frames_folder。
+    """
+
+    def __init__(self, analyzer, queue_size=8, dedup_threshold=None, concurrency=1, context_size=None, player=None,
+                 segment_chars=300, batch_size=1, preprocessor=None, logger=None):
+        self.analyzer = analyzer
+        self.preprocessor = preprocessor  # preprocess.FramePreprocessor，控制帧的缩放尺寸和编码格式
+        self.batch_size = batch_size  # 每个分析请求包含的连续帧数
+        self.player = player  # playback.AudioPlayer，设置后每个片段合成完就开始播放
+        self.segment_chars = segment_chars  # 每个语音合成片段的最大字符数
+        self.queue_size = queue_size
+        self.concurrency = concurrency
+        self.context_size = context_size
+        self.dedup_threshold = dedup_threshold
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.narrations = []
+        self.error = None
+        self.cancelled = False
+        self._stop = threading.Event()
+
+    def _put(self, q, item):
+        """向有界队列放入数据，队列满时等待；流水线已停止时返回 False。"""
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return _DONE
+
+    def cancel(self):
+        """停止流水线；已合成的部分会被丢弃。"""
+        self.cancelled = True
+        self._stop.set()
+        if self.player is not None:
+            self.player.stop()
+
+    def _fail(self, stage, e):
+        self.logger.error(f"{stage}阶段发生错误: {e}")
+        if self.error is None:
+            self.error = e
+        self._stop.set()
+
+    def _extract(self, frame_q, video_path, frame_interval, sampling, frames_folder):
+        gate = DedupGate(self.dedup_threshold) if self.dedup_threshold else None
+        try:
+            for frame in iter_frames(video_path, frame_interval=frame_interval, sampling=sampling,
+                                     folder=frames_folder, preprocessor=self.preprocessor,
+                                     metrics=self.analyzer.metrics):
+                if gate is not None and gate.is_duplicate(frame):
+                    continue
+                self.logger.info(f"📸 帧 {frame['index']} 已提取。")
+                if not self._put(frame_q, frame):
+                    return
+            if gate is not None:
+                self.logger.info(f"相似帧去重跳过了 {gate.skipped} 帧。")
+        except Exception as e:
+            self._fail("帧提取", e)
+        finally:
+            self._put(frame_q, _DONE)
+
+    def _analyze(self, frame_q, text_q):
+        frames = iter(lambda: self._get(frame_q), _DONE)
+        analyzed = 0
+        try:
+            results = self.analyzer.analyze_frames(frames, self.concurrency, self.context_size, self.batch_size)
+            for frame, analysis in results:
+                if analysis:
+                    if not self.narrations:
+                        self.logger.info(f"⏱️ 首条解说用时 {time.monotonic() - self._started:.2f} 秒。")
+                    self.logger.info(f"🎙️ 帧 {frame['index']} 的分析结果:")
+                    self.logger.info(analysis)
+                    self.narrations.append(analysis)
+                    self.analyzer.ai_message = " ".join(self.narrations)
+                    if not self._put(text_q, analysis):
+                        return
+                else:
+                    self.logger.info(f"帧 {frame['index']} 没有获取到分析结果。")
+                analyzed += 1
+                if self.analyzer.progress_callback is not None:
+                    self.analyzer.progress_callback(analyzed, None)
+        except Exception as e:
+            self._fail("图像分析", e)
+        finally:
+            self._put(text_q, _DONE)
+
+    def _synthesize(self, text_q, voice):
+        analyzer = self.analyzer
+        narration_dir = analyzer._narration_dir()
+        voice = analyzer._check_voice(voice)
+        run_id = analyzer._run_id()
+        final_audio_path = os.path.join(narration_dir, f"final_narration_{run_id}.mp3")
+        # 边播放边生成时片段需要落盘，放在本次运行独有的目录中
+        segments_dir = os.path.join(narration_dir, f"run_{run_id}") if self.player is not None else None
+        if segments_dir:
+            os.makedirs(segments_dir)
+        analyzer.latest_audio_path = []
+        count = 0
+        # 片段文件的序号，合成失败的片段也占用序号，避免覆盖播放器可能仍在使用的文件
+        index = 1
+        merger = AudioMerger(final_audio_path)
+        try:
+            while True:
+                text = self._get(text_q)
+                if text is _DONE:
+                    break
+                # 按句子切分成较短的片段，第一段可以尽早合成并开始播放
+                segments = split_sentences(text, self.segment_chars)
+                if segments_dir:
+                    audios = analyzer._synthesize_chunks(segments, voice, segments_dir, index)
+                else:
+                    audios = [audio for audio in analyzer._iter_speech(segments, voice, index) if audio is not None]
+                if audios and not count:
+                    self.logger.info(f"⏱️ 首段音频用时 {time.monotonic() - self._started:.2f} 秒。")
+                for audio in audios:
+                    with analyzer.metrics.span("audio_merge"):
+                        merger.append(audio)
+                    if self.player is not None:
+                        self.player.enqueue(audio)
+                count += len(audios)
+                index += len(segments)
+        except Exception:
+            merger.discard()
+            raise
+        analyzer.total_chunks = count
+        if self.error is not None or self.cancelled or not count:
+            merger.discard()
+            if segments_dir:
+                shutil.rmtree(segments_dir, ignore_errors=True)
+            return None
+        merger.close()
+        if segments_dir:
+            # 片段播放完毕后再删除
+            self.player.wait()
+            shutil.rmtree(segments_dir, ignore_errors=True)
+        analyzer.latest_audio_path = [final_audio_path]
+        self.logger.info(f"🎉 Final audio file saved to: {final_audio_path}")
+        return final_audio_path
+
+    def run(self, video_path, frame_interval=2, voice="alloy", sampling="seek", frames_folder=None):
+        """
+        处理一个视频并返回最终的解说音频路径。
+
+        参数:
+        - video_path: 视频文件的路径。
+        - frame_interval: 提取帧的时间间隔（秒）。
+        - voice: 语音ID。
+        - sampling: 采样模式，见 videos.extract_frames。
+        - frames_folder: 同时将帧保存到该文件夹，默认不落盘。
+
+        结束时与 ImageAnalyzer.main 一样导出 analyzer.metrics。
+        """
+        self._stop.clear()
+        self.cancelled = False
+        self.error = None
+        self.narrations = []
+        self._started = time.monotonic()
+
+        frame_q = queue.Queue(maxsize=self.queue_size)
+        text_q = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            threading.Thread(target=self._extract, args=(frame_q, video_path, frame_interval, sampling, frames_folder),
+                             daemon=True),
+            threading.Thread(target=self._analyze, args=(frame_q, text_q), daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        try:
+            final_audio_path = self._synthesize(text_q, voice)
+        except Exception as e:
+            self._fail("语音合成", e)
+            raise
+        finally:
+            self._stop.set()
+            for t in threads:
+                t.join()
+            self.analyzer.export_metrics()
+
+        if self.error is not None:
+            raise self.error
+        if self.cancelled:
+            self.logger.info("流式处理已取消。")
+            return None
+        self.logger.info(f"流式处理完成，共 {len(self.narrations)} 条解说，"
+                         f"总用时 {time.monotonic() - self._started:.2f} 秒。")
+        return final_audio_path
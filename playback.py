@@ -0,0 +1,62 @@
+# coding: utf-8
+import logging
+import queue
+import threading
+import time
+
+
+class AudioPlayer:
+    """
+    后台按顺序播放音频文件的播放器，基于 pygame.mixer。
+
+    生成一个片段就 enqueue 一个，播放在独立线程中进行，不阻塞后续片段的合成。
+    """
+
+    def __init__(self, mixer=None, logger=None):
+        if mixer is None:
+            import pygame
+            mixer = pygame.mixer
+        if not mixer.get_init():
+            mixer.init()
+        self.mixer = mixer
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.first_played_at = None
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def enqueue(self, path):
+        """加入一个待播放的音频文件。"""
+        self._queue.put(path)
+
+    def _run(self):
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                if self._stopped.is_set():
+                    continue
+                self.mixer.music.load(path)
+                self.mixer.music.play()
+                if self.first_played_at is None:
+                    self.first_played_at = time.monotonic()
+                while self.mixer.music.get_busy() and not self._stopped.is_set():
+                    time.sleep(0.05)
+                # 释放文件，之后才能合并或删除该片段
+                self.mixer.music.unload()
+            except Exception as e:
+                self.logger.error(f"播放音频 {path} 时发生错误: {e}")
+            finally:
+                self._queue.task_done()
+
+    def wait(self):
+        """等待已加入的片段全部播放完毕。"""
+        self._queue.join()
+
+    def stop(self):
+        """停止播放并丢弃尚未播放的片段。"""
+        self._stopped.set()
+        self.mixer.music.stop()
+        self._queue.put(None)
@@ -0,0 +1,90 @@
+# coding: utf-8
+import math
+
+# 编码格式：(文件扩展名, MIME 类型, OpenCV 质量参数名)
+# cv2 在第一次处理帧时才导入，界面等只需要这些常量的地方不必加载 OpenCV
+CODECS = {
+    "jpeg": (".jpg", "image/jpeg", "IMWRITE_JPEG_QUALITY"),
+    "webp": (".webp", "image/webp", "IMWRITE_WEBP_QUALITY"),
+}
+
+# 图像分析接口的 detail 参数
+DETAILS = ("auto", "low", "high")
+
+
+def estimate_image_tokens(width, height, detail="auto"):
+    """
+    按图像分析接口的计费规则估算一张图像的 token 数。
+
+    low 固定为 85；high（auto 按 high 估算）先缩放到 2048x2048 以内、短边不超过 768，
+    再按 512x512 的图块计数，每块 170，另加 85。
+    """
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+class FramePreprocessor:
+    """
+    帧预处理：直接用 OpenCV 缩放（缩小时使用区域插值）并在内存中编码。
+
+    参数:
+    - max_edge: 缩放后图像的最长边（像素）。
+    - codec: 编码格式，"jpeg" 或 "webp"。
+    - quality: 编码质量（0-100）。
+    - detail: 发送给图像分析接口的 detail 参数，也用于估算 token 数。
+    """
+
+    def __init__(self, max_edge=250, codec="jpeg", quality=85, detail="auto"):
+        if codec not in CODECS:
+            raise ValueError(f"未知的编码格式: {codec}")
+        if detail not in DETAILS:
+            raise ValueError(f"未知的 detail 参数: {detail}")
+        self.max_edge = max_edge
+        self.codec = codec
+        self.quality = quality
+        self.detail = detail
+
+    @property
+    def extension(self):
+        return CODECS[self.codec][0]
+
+    @property
+    def mime(self):
+        return CODECS[self.codec][1]
+
+    def resize(self, frame):
+        """等比缩放 BGR 帧，使最长边为 max_edge。"""
+        import cv2
+
+        height, width = frame.shape[:2]
+        ratio = self.max_edge / max(width, height)
+        size = (max(1, int(width * ratio)), max(1, int(height * ratio)))
+        if size == (width, height):
+            return frame
+        interpolation = cv2.INTER_AREA if ratio < 1 else cv2.INTER_CUBIC
+        return cv2.resize(frame, size, interpolation=interpolation)
+
+    def encode(self, frame):
+        """将 BGR 帧编码为图像字节。"""
+        import cv2
+
+        extension, _, quality_flag = CODECS[self.codec]
+        ok, buffer = cv2.imencode(extension, frame, [getattr(cv2, quality_flag), int(self.quality)])
+        if not ok:
+            raise IOError("图像编码失败")
+        return buffer.tobytes()
+
+    def process(self, frame):
+        """
+        缩放并编码一帧，返回 (图像字节, 信息字典)，信息包括 width、height、bytes 和估算的 tokens。
+        """
+        frame = self.resize(frame)
+        image = self.encode(frame)
+        height, width = frame.shape[:2]
+        return image, {"width": width, "height": height, "bytes": len(image),
+                       "tokens": estimate_image_tokens(width, height, self.detail)}
@@ -0,0 +1,156 @@
+# coding: utf-8
+import email.utils
+import logging
+import random
+import re
+import threading
+import time
+
+
+def retryable_errors():
+    """可以重试的错误：限流、连接问题和服务端错误。openai 在第一次发送请求时才导入。"""
+    import openai
+
+    return openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """解析 x-ratelimit-reset-* 中的时长（如 "1s"、"6m0s"、"20ms"），返回秒数，无法解析时返回 None。"""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def parse_retry_after(headers):
+    """从 retry-after-ms / retry-after 响应头中取得需要等待的秒数，没有时返回 None。"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        date = email.utils.parsedate_to_datetime(value)
+        return max(0.0, date.timestamp() - time.time()) if date else None
+
+
+class RateLimiter:
+    """
+    由响应头驱动的自适应限流器，可在多个线程和多种请求（对话、语音合成）间共享。
+
+    根据 x-ratelimit-remaining-requests / -tokens 和对应的 reset 响应头记录剩余额度，额度用完时
+    阻塞到重置时间；请求失败时按 retry-after 或带抖动的指数退避等待后重试。退避期间所有调用方一起暂停，
+    避免同时重试造成新的 429。
+    """
+
+    def __init__(self, max_retries=6, base_delay=1.0, max_delay=60.0, logger=None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.remaining_requests = None
+        self.remaining_tokens = None
+        self.requests_reset_at = 0.0
+        self.tokens_reset_at = 0.0
+        self.blocked_until = 0.0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def _delay(self, tokens):
+        """返回发送一个估计消耗 tokens 的请求前需要等待的秒数，并预先扣减额度。"""
+        with self._lock:
+            now = time.monotonic()
+            if self.remaining_requests is not None and now >= self.requests_reset_at:
+                self.remaining_requests = None
+            if self.remaining_tokens is not None and now >= self.tokens_reset_at:
+                self.remaining_tokens = None
+            wait = max(0.0, self.blocked_until - now)
+            if self.remaining_requests is not None and self.remaining_requests <= 0:
+                wait = max(wait, self.requests_reset_at - now)
+            if self.remaining_tokens is not None and self.remaining_tokens < tokens:
+                wait = max(wait, self.tokens_reset_at - now)
+            if wait <= 0:
+                if self.remaining_requests is not None:
+                    self.remaining_requests -= 1
+                if self.remaining_tokens is not None:
+                    self.remaining_tokens -= tokens
+            return wait
+
+    def acquire(self, tokens=0):
+        """阻塞直到额度允许发送请求。"""
+        while True:
+            wait = self._delay(tokens)
+            if wait <= 0:
+                return
+            self.logger.info(f"⏳ 限流中，等待 {wait:.1f} 秒后发送请求。")
+            time.sleep(wait)
+
+    def update(self, headers):
+        """用响应头更新剩余额度。"""
+        now = time.monotonic()
+        with self._lock:
+            requests = headers.get("x-ratelimit-remaining-requests")
+            if requests is not None and requests.isdigit():
+                self.remaining_requests = int(requests)
+                reset = parse_duration(headers.get("x-ratelimit-reset-requests"))
+                self.requests_reset_at = now + (reset if reset is not None else 1.0)
+            tokens = headers.get("x-ratelimit-remaining-tokens")
+            if tokens is not None and tokens.isdigit():
+                self.remaining_tokens = int(tokens)
+                reset = parse_duration(headers.get("x-ratelimit-reset-tokens"))
+                self.tokens_reset_at = now + (reset if reset is not None else 1.0)
+
+    def backoff(self, attempt, retry_after=None):
+        """计算第 attempt 次重试前的等待时间，并让所有调用方一起暂停。"""
+        if retry_after is None:
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+        else:
+            delay = min(self.max_delay, retry_after) + random.uniform(0, self.base_delay / 4)
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self.retries += 1
+        return delay
+
+    def call(self, create, tokens=0, **kwargs):
+        """
+        通过限流器调用 OpenAI 接口并返回解析后的结果。
+
+        create 需为某个资源的 with_raw_response.create，以便读取限流响应头；可重试的错误按退避策略重试，
+        超过 max_retries 次后抛出最后一次的异常。
+        """
+        errors = retryable_errors()
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                raw = create(**kwargs)
+            except errors as e:
+                response = getattr(e, "response", None)
+                if response is not None:
+                    self.update(response.headers)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt, parse_retry_after(response.headers if response is not None else None))
+                attempt += 1
+                self.logger.warning(f"请求失败（{type(e).__name__}），{delay:.1f} 秒后进行第 {attempt} 次重试。")
+                time.sleep(delay)
+                continue
+            self.update(raw.headers)
+            return raw.parse()
@@ -1,20 +1,235 @@
 # coding: utf-8
+"""
+无界面批量处理：处理一个或多个视频（或目录中的全部视频），每个视频使用独立的输出目录，
+多个视频由线程池并行处理，最后输出吞吐量汇总。
+
+用法：python runner.py videos/ other.mp4 --jobs 2 --output runs --frame-interval 2
+API 密钥和基本URL默认读取环境变量 OPENAI_API_KEY 和 OPENAI_BASE_URL。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from content_cache import CACHE_MODES, ContentCache
+from frame_filter import dedup_frames
+from http_pool import shared_pool
+from journal import Journal
+from metrics import Metrics
+from preprocess import CODECS, DETAILS, FramePreprocessor
+from rate_limit import RateLimiter
 from video_narrator import ImageAnalyzer
-from videos import extract_frames
+from videos import SAMPLING_MODES, extract_frames
 
-if __name__ == "__main__":
+# 按扩展名识别目录中的视频文件
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v", ".flv", ".wmv")
+
+
+def find_videos(paths):
+    """展开命令行中的文件和目录（目录不递归），返回视频文件路径列表，保持给定顺序并去重。"""
+    videos = []
+    for path in paths:
+        if os.path.isdir(path):
+            videos.extend(os.path.join(path, f) for f in sorted(os.listdir(path))
+                          if f.lower().endswith(VIDEO_EXTENSIONS))
+        elif os.path.isfile(path):
+            videos.append(path)
+        else:
+            raise FileNotFoundError(f"找不到视频文件或目录: {path}")
+    return list(dict.fromkeys(os.path.abspath(v) for v in videos))
+
+
+def job_dirs(videos, output):
+    """为每个视频分配独立的输出目录，同名视频追加序号。"""
+    dirs, used = [], set()
+    for video in videos:
+        name = os.path.splitext(os.path.basename(video))[0]
+        candidate, n = name, 1
+        while candidate in used:
+            n += 1
+            candidate = f"{name}_{n}"
+        used.add(candidate)
+        dirs.append(os.path.join(os.path.abspath(output), candidate))
+    return dirs
+
+
+def video_duration(video_path):
+    """返回视频时长（秒），无法获取时返回 None。"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        return frames / fps if fps and fps > 0 and frames > 0 else None
+    finally:
+        cap.release()
+
+
+def run_job(video_path, output_dir, args, rate_limiter, cache, audio_cache, work_queue=None):
+    """
+    处理一个视频：帧保存在 output_dir/frames，音频在 output_dir/narration，统计数据在 output_dir/metrics。
+
+    进度记录在 output_dir/journal.jsonl 中，中断后重新运行会跳过已提取的帧、已完成的分析和已合成的音频片段。
+    设置了 work_queue 时，图像分析和语音合成交给队列另一端的 worker 执行，帧提取和音频合并仍在本机进行。
+
+    返回:
+    - 任务结果字典：video、output_dir、duration（秒）、frames（分析的帧数）、audio、seconds 和 error（成功时为 None）。
+    """
+    name = os.path.basename(output_dir)
+    logger = logging.getLogger(f"runner.{name}")
+    started = time.monotonic()
+    result = {"video": video_path, "output_dir": output_dir, "duration": video_duration(video_path),
+              "frames": 0, "audio": None, "seconds": None, "error": None}
+    journal = None
     try:
-        frame_interval = input("请输入帧提取的时间间隔（秒）: ")
-        _video_path = input("请输入视频文件的路径: ")
-        extract_frames(video_path=_video_path,frame_interval=frame_interval)
+        os.makedirs(output_dir, exist_ok=True)
+        journal_path = os.path.join(output_dir, "journal.jsonl")
+        if args.restart and os.path.exists(journal_path):
+            os.remove(journal_path)
+        journal = Journal(journal_path, logger=logger)
+        metrics = Metrics()
+        preprocessor = FramePreprocessor(max_edge=args.max_edge, codec=args.codec, detail=args.detail)
+        stats = extract_frames(video_path, folder=os.path.join(output_dir, "frames"),
+                               frame_interval=args.frame_interval, sampling=args.sampling,
+                               workers=args.extract_workers, preprocessor=preprocessor, metrics=metrics,
+                               journal=journal, max_frames=args.max_frames, max_tokens=args.max_tokens)
+        frames = stats["frames"]
+        if not frames:
+            raise IOError("没有提取到任何帧")
+        if args.dedup_threshold:
+            frames = dedup_frames(frames, threshold=args.dedup_threshold, logger=logger)
+        result["frames"] = len(frames)
+
+        analyzer = ImageAnalyzer(args.api_key, args.voice, base_url=args.base_url, logger=logger,
+                                 language=args.language, request_interval=0, cache=cache, model=args.model,
+                                 audio_cache=audio_cache, rate_limiter=rate_limiter, image_detail=args.detail,
+                                 metrics=metrics, output_dir=output_dir, journal=journal, work_queue=work_queue,
+                                 timeline=args.timeline, video_duration=result["duration"])
+        analyzer.main(voice=args.voice, frames=frames, concurrency=args.concurrency,
+                      context_size=5 if args.concurrency > 1 else None, batch_size=args.batch_size)
+        audio = analyzer.get_latest_audio_path()
+        result["audio"] = audio[0] if audio else None
+        if result["audio"] is None:
+            raise IOError("没有生成解说音频")
     except Exception as e:
-        print(f"提取帧过程中发生错误: {e}")
-        raise e
-    # 请根据实际情况替换API密钥和声音ID
-    openai_api_key = input("请输入OpenAI的API密钥: ")
-    elevenlabs_api_key = input("请输入ElevenLabs的API密钥: ")
-    elevenlabs_voice_id = input("请输入ElevenLabs的声音ID: ")
-    base_url = input("请输入OpenAI API的基本URL（按Enter键跳过）: ")
-
-    analyzer = ImageAnalyzer(openai_api_key, elevenlabs_api_key, elevenlabs_voice_id)
-    analyzer.main()
+        logger.error(f"处理 {video_path} 时发生错误: {e}")
+        result["error"] = str(e)
+    finally:
+        if journal is not None:
+            journal.close()
+    result["seconds"] = round(time.monotonic() - started, 3)
+    logger.info(f"{'✅' if result['error'] is None else '❌'} {os.path.basename(video_path)} 用时 "
+                f"{result['seconds']:.1f} 秒，输出目录: {output_dir}")
+    return result
+
+
+def summarize(results, wall_seconds):
+    """汇总全部任务的结果和吞吐量。"""
+    done = [r for r in results if r["error"] is None]
+    duration = sum(r["duration"] or 0 for r in done)
+    frames = sum(r["frames"] for r in done)
+    return {
+        "videos": len(results),
+        "succeeded": len(done),
+        "failed": len(results) - len(done),
+        "wall_seconds": round(wall_seconds, 3),
+        "video_seconds": round(duration, 3),
+        "frames": frames,
+        "videos_per_hour": round(len(done) * 3600 / wall_seconds, 2) if wall_seconds else None,
+        "frames_per_s": round(frames / wall_seconds, 3) if wall_seconds else None,
+        # 每秒处理时间能处理多少秒视频
+        "realtime_factor": round(duration / wall_seconds, 3) if wall_seconds else None,
+        "jobs": results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批量为视频生成解说音频")
+    parser.add_argument("paths", nargs="+", help="视频文件或包含视频的目录")
+    parser.add_argument("--output", default="runs", help="输出目录，每个视频一个子目录，默认为 runs")
+    parser.add_argument("--jobs", type=int, default=1, help="同时处理的视频数，默认为1")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI API密钥，默认读取环境变量 OPENAI_API_KEY")
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                        help="OpenAI API的基本URL，默认读取环境变量 OPENAI_BASE_URL")
+    parser.add_argument("--model", default=os.environ.get("NARRATOR_MODEL", "gpt-4o"), help="图像分析模型")
+    parser.add_argument("--voice", default=os.environ.get("NARRATOR_VOICE", "alloy"), help="语音ID")
+    parser.add_argument("--language", default=os.environ.get("NARRATOR_LANGUAGE", "中文"), help="解说语言")
+    parser.add_argument("--frame-interval", type=float, default=2, help="帧提取的时间间隔（秒）")
+    parser.add_argument("--sampling", choices=SAMPLING_MODES, default="seek", help="采样模式")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="每个视频最多分析的帧数；从按 --frame-interval 密集采样的候选帧中选出最有代表性且差异最大的帧")
+    parser.add_argument("--max-tokens", type=int, default=None, help="每个视频的图像 token 预算，按每帧的估算 token 数折算为帧数")
+    parser.add_argument("--extract-workers", type=int, default=1, help="每个视频的帧提取进程数")
+    parser.add_argument("--dedup-threshold", type=float, default=None, help="相似帧去重阈值（0-1）")
+    parser.add_argument("--concurrency", type=int, default=1, help="每个视频的并发分析请求数")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次请求的帧数")
+    parser.add_argument("--max-edge", type=int, default=250, help="图像最长边（像素）")
+    parser.add_argument("--codec", choices=tuple(CODECS), default="jpeg", help="图像格式")
+    parser.add_argument("--detail", choices=DETAILS, default="auto", help="图像细节")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use", help="缓存模式")
+    parser.add_argument("--timeline", action="store_true",
+                        help="每帧的解说单独合成并按时间放置，导出 SRT/VTT 字幕；重新运行时只合成有变化的片段")
+    parser.add_argument("--http1", action="store_true", help="只使用 HTTP/1.1，不启用 HTTP/2")
+    parser.add_argument("--max-connections", type=int, default=20, help="共享连接池的最大连接数")
+    parser.add_argument("--redis-url", default=None,
+                        help="Redis 地址；设置后只提交任务，由 worker.py 执行图像分析和语音合成，--concurrency 为同时排队的任务数")
+    parser.add_argument("--queue", default="narrator", help="Redis 队列名称，默认为 narrator")
+    parser.add_argument("--result-timeout", type=float, default=None, help="等待单个远程任务结果的最长时间（秒）")
+    parser.add_argument("--restart", action="store_true", help="丢弃上次运行的进度日志，从头处理")
+    parser.add_argument("--summary", help="将汇总结果另存为 JSON 文件")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("缺少 OpenAI API密钥：请设置环境变量 OPENAI_API_KEY 或使用 --api-key")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    videos = find_videos(args.paths)
+    if not videos:
+        logging.error("没有找到需要处理的视频。")
+        return 1
+    dirs = job_dirs(videos, args.output)
+
+    # 连接池、限流器和缓存在全部任务间共享
+    pool = shared_pool(http2=not args.http1, max_connections=args.max_connections,
+                       max_keepalive=args.max_connections)
+    rate_limiter = RateLimiter()
+    cache = ContentCache(os.path.join(os.getcwd(), "cache", "analysis.sqlite3"), mode=args.cache)
+    audio_cache = ContentCache(os.path.join(os.getcwd(), "cache", "tts.sqlite3"), mode=args.cache,
+                               max_bytes=2 * 1024 * 1024 * 1024)
+    work_queue = None
+    if args.redis_url:
+        from work_queue import FrameQueue
+
+        work_queue = FrameQueue.from_url(args.redis_url, name=args.queue, result_timeout=args.result_timeout)
+    started = time.monotonic()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+            results = list(executor.map(lambda job: run_job(job[0], job[1], args, rate_limiter, cache, audio_cache,
+                                                            work_queue),
+                                        zip(videos, dirs)))
+    finally:
+        cache.close()
+        audio_cache.close()
+    summary = summarize(results, time.monotonic() - started)
+    summary["http_pool"] = pool.stats()
+
+    text = json.dumps(summary, ensure_ascii=False, indent=2)
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+    logging.info(f"共处理 {summary['videos']} 个视频，成功 {summary['succeeded']} 个，失败 {summary['failed']} 个，"
+                 f"总用时 {summary['wall_seconds']:.1f} 秒，实时倍率 {summary['realtime_factor']}。")
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# coding: utf-8
+"""
+启动耗时检查：在子进程中用 python -X importtime 导入指定模块（默认为 gui），报告各模块的导入耗时，
+并检查总耗时是否超出预算、是否在启动时就导入了本应延迟加载的重量级模块。超出时以状态码 1 退出。
+
+用法：python startup_time.py --budget 0.5 --top 15
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# 启动时不应导入的模块，它们只在处理视频或播放音频时才需要（PIL 由 ttkthemes 导入，无法延迟）
+HEAVY_MODULES = ("cv2", "numpy", "openai", "httpx", "pygame", "pyperclip")
+
+
+def import_times(module="gui", python=sys.executable):
+    """
+    在新的解释器中导入 module，返回 (总耗时秒数, 各模块记录列表)。
+
+    记录为 {"module", "self", "cumulative"}，时间单位为秒，按 -X importtime 的输出顺序排列。
+    """
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr}")
+    records = []
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        records.append({"module": name.strip(), "self": int(self_us) / 1e6, "cumulative": int(cumulative_us) / 1e6})
+        # 被其他模块间接导入的模块名前有额外缩进，顶层模块的累计耗时之和即为总耗时
+        if not name[1:].startswith(" "):
+            total += records[-1]["cumulative"]
+    return total, records
+
+
+def check(module="gui", budget=0.5, heavy=HEAVY_MODULES, top=15):
+    """执行检查并返回报告字典，ok 为 False 表示超出预算或导入了重量级模块。"""
+    total, records = import_times(module)
+    loaded = sorted({r["module"].split(".")[0] for r in records} & set(heavy))
+    slowest = sorted(records, key=lambda r: r["self"], reverse=True)[:top]
+    return {
+        "module": module,
+        "total_seconds": round(total, 4),
+        "budget_seconds": budget,
+        "heavy_modules_loaded": loaded,
+        "ok": total <= budget and not loaded,
+        "slowest": [{"module": r["module"], "self_ms": round(r["self"] * 1000, 2),
+                     "cumulative_ms": round(r["cumulative"] * 1000, 2)} for r in slowest],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查模块的导入耗时")
+    parser.add_argument("--module", default="gui", help="要检查的模块，默认为 gui")
+    parser.add_argument("--budget", type=float, default=0.5, help="导入耗时预算（秒），默认为0.5")
+    parser.add_argument("--top", type=int, default=15, help="列出自身耗时最长的模块数")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    report = check(args.module, args.budget, top=args.top)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"导入 {report['module']} 用时 {report['total_seconds'] * 1000:.1f} 毫秒"
+              f"（预算 {report['budget_seconds'] * 1000:.0f} 毫秒）")
+        for r in report["slowest"]:
+            print(f"  {r['self_ms']:8.2f} ms  {r['cumulative_ms']:8.2f} ms  {r['module']}")
+        if report["heavy_modules_loaded"]:
+            print(f"启动时导入了应延迟加载的模块: {', '.join(report['heavy_modules_loaded'])}")
+    sys.exit(0 if report["ok"] else 1)
@@ -0,0 +1,246 @@
+# coding: utf-8
+"""
+解说时间线：每个有解说的帧对应一个带开始和结束时间的片段，可以导出 SRT/VTT 字幕，
+每个片段单独合成音频并按时间放置在最终音频中。
+
+修改部分解说后重新渲染时，只有文本或语音变化的片段会重新合成，其余片段复用已保存的音频。
+
+用法（修改字幕后重新生成音频）：python timeline.py runs/clip/narration/timeline.json --srt edited.srt
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+from audio_merge import AudioMerger, mp3_duration, mp3_frames
+from content_cache import content_key
+
+# SRT 时间码，如 00:01:02,345 --> 00:01:04,000（也接受 VTT 的小数点）
+_CUE_TIMES = re.compile(r"(\d+):(\d{2}):(\d{2})[,.](\d{3})\s*-->\s*(\d+):(\d{2}):(\d{2})[,.](\d{3})")
+
+
+def _timecode(seconds, separator=","):
+    milliseconds = int(round(max(0.0, seconds) * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{separator}{milliseconds:03d}"
+
+
+def parse_srt(text):
+    """解析 SRT（或 VTT）字幕，返回 [(开始秒数, 结束秒数, 文本), ...]，按出现顺序排列。"""
+    cues = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n").strip()):
+        lines = block.strip().split("\n")
+        for i, line in enumerate(lines):
+            match = _CUE_TIMES.search(line)
+            if match:
+                h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(g) for g in match.groups())
+                cues.append((h1 * 3600 + m1 * 60 + s1 + ms1 / 1000, h2 * 3600 + m2 * 60 + s2 + ms2 / 1000,
+                             "\n".join(lines[i + 1:]).strip()))
+                break
+    return cues
+
+
+class Timeline:
+    """
+    按时间排列的解说片段。
+
+    每个片段是一个字典：frame（帧标识）、start / end（在视频中的时间，秒）、text、voice（为空时使用时间线的 voice），
+    以及渲染后写入的 audio（片段音频路径）、audio_key（合成该音频时的文本、语音和模型的哈希）、
+    audio_start（在最终音频中实际开始的时间）和 audio_duration。
+
+    参数:
+    - segments: 片段列表。
+    - voice: 默认语音ID。
+    - tts_model: 语音合成模型。
+    """
+
+    def __init__(self, segments=None, voice="alloy", tts_model="tts-1"):
+        self.segments = segments if segments is not None else []
+        self.voice = voice
+        self.tts_model = tts_model
+
+    @classmethod
+    def from_frames(cls, results, voice="alloy", tts_model="tts-1", duration=None):
+        """
+        用按时间排序的 (帧记录, 解说) 创建时间线，帧记录须包含 timestamp。
+
+        每个片段从本帧的时间开始，到下一帧的时间结束；最后一帧持续到 duration（视频时长），
+        未给出时使用相邻帧的平均间隔。给出 duration 时片段的结束时间不超过视频时长。没有解说的帧不生成片段。
+        """
+        results = list(results)
+        times = [frame["timestamp"] for frame, _ in results]
+        step = (times[-1] - times[0]) / (len(times) - 1) if len(times) > 1 else 2.0
+        segments = []
+        for i, (frame, text) in enumerate(results):
+            if not text:
+                continue
+            if i + 1 < len(times):
+                end = times[i + 1]
+            else:
+                end = duration if duration is not None and duration > times[i] else times[i] + step
+            if duration is not None and times[i] < duration:
+                end = min(end, duration)
+            key = frame.get("index") if frame.get("index") is not None else os.path.basename(frame.get("path") or "")
+            segments.append({"frame": key, "start": round(times[i], 3), "end": round(end, 3), "text": text.strip()})
+        return cls(segments, voice=voice, tts_model=tts_model)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["segments"], voice=data.get("voice", "alloy"), tts_model=data.get("tts_model", "tts-1"))
+
+    def save(self, path):
+        """写入 JSON 文件（先写临时文件再替换）。"""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"voice": self.voice, "tts_model": self.tts_model, "segments": self.segments}, f,
+                      ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def merge_previous(self, previous):
+        """
+        从上一次渲染的时间线中继承相同帧的音频信息，之后 render 只需合成文本或语音有变化的片段。
+        """
+        rendered = {s["frame"]: s for s in previous.segments if s.get("audio")}
+        for segment in self.segments:
+            old = rendered.get(segment["frame"])
+            if old is not None:
+                for field in ("audio", "audio_key", "audio_duration"):
+                    segment[field] = old.get(field)
+
+    def to_srt(self):
+        return "\n".join(f"{i}\n{_timecode(s['start'])} --> {_timecode(s['end'])}\n{s['text']}\n"
+                         for i, s in enumerate(self.segments, 1))
+
+    def to_vtt(self):
+        return "WEBVTT\n\n" + "\n".join(f"{_timecode(s['start'], '.')} --> {_timecode(s['end'], '.')}\n{s['text']}\n"
+                                        for s in self.segments)
+
+    def export_subtitles(self, path_prefix):
+        """写入 path_prefix.srt 和 path_prefix.vtt，返回两个文件路径。"""
+        paths = (f"{path_prefix}.srt", f"{path_prefix}.vtt")
+        for path, text in zip(paths, (self.to_srt(), self.to_vtt())):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return paths
+
+    def import_srt(self, path):
+        """
+        用编辑后的字幕更新片段的文本和时间，字幕条目按顺序对应片段。
+
+        返回:
+        - 文本有变化的片段数。
+        """
+        with open(path, "r", encoding="utf-8-sig") as f:
+            cues = parse_srt(f.read())
+        if len(cues) != len(self.segments):
+            raise ValueError(f"字幕有 {len(cues)} 条，时间线有 {len(self.segments)} 个片段，无法对应")
+        changed = 0
+        for segment, (start, end, text) in zip(self.segments, cues):
+            if text != segment["text"]:
+                changed += 1
+            segment.update(start=start, end=end, text=text)
+        return changed
+
+    def segment_key(self, segment):
+        return content_key("tts", self.tts_model, segment.get("voice") or self.voice, segment["text"])
+
+    def stale(self):
+        """返回需要重新合成的片段：没有音频、音频文件已丢失，或文本和语音与合成时不同。"""
+        return [s for s in self.segments
+                if not s.get("audio") or not os.path.exists(s["audio"]) or s.get("audio_key") != self.segment_key(s)]
+
+    def render(self, synthesize, segments_dir, output_path, logger=None):
+        """
+        合成变化的片段，并按各片段的开始时间把全部片段写入 output_path。
+
+        片段音频比它的时间段长时，下一个片段紧接着播放，不会重叠。
+
+        参数:
+        - synthesize: synthesize(文本列表, 语音) 按顺序产出每段文本的音频字节，失败时为 None。
+        - segments_dir: 片段音频的保存目录。
+        - output_path: 最终音频文件路径。
+
+        返回:
+        - 统计字典：synthesized、reused、failed、output（没有任何片段时为 None）和 duration（秒）。
+        """
+        logger = logger if logger is not None else logging.getLogger(__name__)
+        os.makedirs(segments_dir, exist_ok=True)
+        stale = self.stale()
+        stats = {"synthesized": 0, "reused": len(self.segments) - len(stale), "failed": 0,
+                 "output": None, "duration": 0.0}
+        if stale:
+            logger.info(f"🎞️ 时间线共 {len(self.segments)} 个片段，需要合成 {len(stale)} 个，复用 {stats['reused']} 个。")
+        by_voice = {}
+        for segment in stale:
+            by_voice.setdefault(segment.get("voice") or self.voice, []).append(segment)
+        for voice, segments in by_voice.items():
+            for segment, audio in zip(segments, synthesize([s["text"] for s in segments], voice)):
+                if audio is None:
+                    stats["failed"] += 1
+                    segment["audio"] = segment["audio_key"] = None
+                    continue
+                key = self.segment_key(segment)
+                path = os.path.join(segments_dir, f"segment_{key[:16]}.mp3")
+                with open(path, "wb") as f:
+                    f.write(audio)
+                segment.update(audio=path, audio_key=key, audio_duration=round(mp3_duration(mp3_frames(audio)), 3))
+                stats["synthesized"] += 1
+
+        with AudioMerger(output_path) as merger:
+            for segment in sorted(self.segments, key=lambda s: s["start"]):
+                if not segment.get("audio"):
+                    continue
+                segment["audio_start"] = round(merger.append(segment["audio"], at=segment["start"]), 3)
+                if segment["audio_start"] > segment["start"] + 0.5:
+                    logger.debug(f"片段 {segment['frame']} 的音频推迟了 {segment['audio_start'] - segment['start']:.1f} 秒。")
+        if not merger.segments:
+            merger.discard()
+            return stats
+        stats.update(output=output_path, duration=round(merger.duration, 3))
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按时间线重新生成解说音频，只合成有变化的片段")
+    parser.add_argument("timeline", help="timeline.json 文件路径")
+    parser.add_argument("--srt", help="编辑后的字幕文件，用其中的文本和时间更新时间线")
+    parser.add_argument("--voice", help="更换默认语音")
+    parser.add_argument("--output", help="输出音频路径，默认在时间线所在目录生成新的 final_narration_*.mp3")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI API密钥，默认读取环境变量 OPENAI_API_KEY")
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                        help="OpenAI API的基本URL，默认读取环境变量 OPENAI_BASE_URL")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("缺少 OpenAI API密钥：请设置环境变量 OPENAI_API_KEY 或使用 --api-key")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+
+    from video_narrator import ImageAnalyzer
+
+    timeline = Timeline.load(args.timeline)
+    if args.srt:
+        logging.info(f"字幕中有 {timeline.import_srt(args.srt)} 个片段的文本有变化。")
+    if args.voice:
+        timeline.voice = args.voice
+    directory = os.path.dirname(os.path.abspath(args.timeline))
+    analyzer = ImageAnalyzer(args.api_key, timeline.voice, base_url=args.base_url, request_interval=0,
+                             tts_model=timeline.tts_model, output_dir=os.path.dirname(directory))
+    output = args.output or os.path.join(directory, f"final_narration_{time.strftime('%Y%m%d_%H%M%S')}.mp3")
+    started = time.monotonic()
+    stats = timeline.render(analyzer._timeline_speech, os.path.join(directory, "segments"), output)
+    timeline.save(args.timeline)
+    timeline.export_subtitles(os.path.splitext(args.timeline)[0])
+    logging.info(f"合成 {stats['synthesized']} 个片段，复用 {stats['reused']} 个，失败 {stats['failed']} 个，"
+                 f"用时 {time.monotonic() - started:.1f} 秒。音频: {stats['output']}")
+    return 0 if stats["output"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,20 +5,111 @@ import base64
 import shutil
 import time
 import errno
+import json
+import re
+import uuid
 from openai import OpenAI
 
+from audio_merge import AudioMerger, mp3_frames
+from content_cache import content_key
+from http_pool import shared_pool
+from metrics import Metrics, profile
+from narration_context import NarrationContext, estimate_messages_tokens
+from timeline import Timeline
+
+# 语音合成接口单次请求的最大字符数
+TTS_MAX_CHARS = 4096
+
+# 句末标点（含中文标点；英文句点须后跟空白），后面可以跟引号或括号
+_SENTENCE_END = re.compile(r'.*?(?:[。！？!?…；;\n]+|\.+(?=\s|$))[”’"\'」』）)]*|.+$', re.S)
+
+# 图像文件头的 base64 前缀与对应的 MIME 类型
+_IMAGE_PREFIXES = (("/9j/", "image/jpeg"), ("UklGR", "image/webp"), ("iVBOR", "image/png"))
+
+
+def split_sentences(text, max_chars=TTS_MAX_CHARS):
+    """
+    按句子边界把文本切分为不超过 max_chars 个字符的片段。
+
+    相邻的句子会合并到同一个片段中；单个句子超过 max_chars 时才在句子内部切开。
+    """
+    segments = []
+    current = ""
+    for sentence in _SENTENCE_END.findall(text):
+        if not sentence.strip():
+            # 保留空行等分隔符，否则前后两句会直接粘在一起；片段开头或放不下时才丢弃
+            if current and len(current) + len(sentence) <= max_chars:
+                current += sentence
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if len(current) + len(sentence) > max_chars:
+            segments.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        segments.append(current)
+    return [segment.strip() for segment in segments if segment.strip()]
+
+
+def _batch_narrations(content, count):
+    """解析批量分析的 JSON 回复，返回 narrations 列表；无法解析或条数不等于 count 时返回 None。"""
+    try:
+        narrations = json.loads(content)["narrations"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    return narrations if isinstance(narrations, list) and len(narrations) == count else None
+
 
 class ImageAnalyzer:
-    def __init__(self, openai_api_key, voice_id, base_url=None, logger=None,language="中文"):
+    def __init__(self, openai_api_key, voice_id, base_url=None, logger=None,language="中文", request_interval=5,
+                 context_tokens=2000, cache=None, model="gpt-4o", audio_cache=None, tts_model="tts-1",
+                 tts_concurrency=4, rate_limiter=None, image_detail="auto", metrics=None, profile_path=None,
+                 output_dir=None, journal=None, http_pool=None, work_queue=None, timeline=False,
+                 video_duration=None):
         self.latest_audio_path = None
+        self.model = model
+        self.cache = cache  # ContentCache，缓存图像分析结果，None 表示不使用缓存
+        self.tts_model = tts_model
+        self.audio_cache = audio_cache  # ContentCache，缓存合成的音频
+        self.tts_concurrency = tts_concurrency  # 同时进行的语音合成请求数
+        self.request_interval = request_interval  # 两次图像分析请求之间的等待时间（秒）
+        self.network_requests = 0  # 实际发出的图像分析请求数（不含缓存和日志命中），用于判断是否需要等待
+        self.context_tokens = context_tokens  # 每次请求附带的历史解说的 token 预算
+        self.image_detail = image_detail  # 图像分析的 detail 参数："auto"、"low" 或 "high"
+        self.metrics = metrics if metrics is not None else Metrics()  # 各阶段耗时和 token 用量，main 结束时导出
+        self.profile_path = profile_path  # 设置后用 cProfile 分析 main，结果写入该文件
+        self.output_dir = output_dir  # narration、metrics 和默认的 video_frames 目录所在位置，默认为当前目录
+        self.journal = journal  # Journal，记录已完成的分析和音频片段，重新运行时跳过
+        self._journaled = {}  # 日志中已完成的分析：帧标识 → 解说
+        # FrameQueue，设置后图像分析和语音合成请求交给远程 worker 执行，concurrency 即同时排队的任务数
+        self.work_queue = work_queue
+        # 为 True 时每帧的解说单独合成并按帧的时间放置，同时导出 SRT/VTT 字幕；要求帧记录包含 timestamp
+        self.timeline = timeline
+        self.video_duration = video_duration  # 视频时长（秒），时间线的最后一个片段到此结束
         self.total_chunks = None
+        self.ai_message = ''
+        self.cancel_event = None  # threading.Event，设置后停止发送新的分析请求
+        self.progress_callback = None  # progress_callback(已完成帧数, 总帧数或 None)
         self.voice_id = voice_id
         self.lanuage = language
         self.logger = logger if logger is not None else logging.getLogger(__name__)
+        # RateLimiter，可在多个 ImageAnalyzer 间共享；设置后由它负责限流和重试
+        self.rate_limiter = rate_limiter
+        # HttpPool，默认使用进程内共享的连接池，多个 ImageAnalyzer 和语音合成请求复用同一批连接。
+        # 不要调用 self.client.close()，那会关闭共享的连接池
+        self.http_pool = http_pool if http_pool is not None else shared_pool()
+        client_options = {"http_client": self.http_pool.client}
+        if rate_limiter is not None:
+            client_options["max_retries"] = 0
         if base_url:
-            self.client = OpenAI(api_key=openai_api_key, base_url=base_url)
+            self.client = OpenAI(api_key=openai_api_key, base_url=base_url, **client_options)
         else:
-            self.client = OpenAI(api_key=openai_api_key)
+            self.client = OpenAI(api_key=openai_api_key, **client_options)
 
 
     def encode_image(self, image_path):
@@ -31,6 +122,11 @@ class ImageAnalyzer:
                     raise
                 time.sleep(0.1)
 
+    def _image_url(self, base64_image):
+        """按 base64 数据的文件头确定图像格式，生成 image_url 内容。"""
+        mime = next((m for prefix, m in _IMAGE_PREFIXES if base64_image.startswith(prefix)), "image/jpeg")
+        return {"url": f"data:{mime};base64,{base64_image}", "detail": self.image_detail}
+
     def generate_new_line(self, base64_image):
         data = [
         {
@@ -39,9 +135,7 @@ class ImageAnalyzer:
                 {"type": "text", "text": "Describe this image"},
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"data:image/jpeg;base64,{base64_image}"
-                    }
+                    "image_url": self._image_url(base64_image)
                 },
             ],
         },
@@ -50,185 +144,595 @@ class ImageAnalyzer:
         # self.logger.info(data)
         return data
 
-    def analyze_image(self, base64_image, script):
-        try:
-            # self.logger.info(f"正在发送的图像数据: {self.generate_new_line(base64_image)}")
-            response = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                             {
-                                 "role": "system",
-                                 "content": f"""
+    def _system_message(self):
+        return {
+            "role": "system",
+            "content": f"""
                         请使用{self.lanuage}进行回答：
                         You are Sir David Attenborough. Narrate the picture of the human as if it is a nature documentary.
                         Make it snarky and funny. Don't repeat yourself. Make it short. If I do anything remotely interesting, make a big deal about it!
                         """,
-                             },
-                         ]
-                         + script
-                         + self.generate_new_line(base64_image),
+        }
+
+    def _create(self, resource, tokens=0, **kwargs):
+        """调用 OpenAI 接口；设置了 rate_limiter 时经由限流器发送并自动重试。"""
+        if self.rate_limiter is None:
+            return resource.create(**kwargs)
+        return self.rate_limiter.call(resource.with_raw_response.create, tokens=tokens, **kwargs)
+
+    def _vision_request(self, messages, cache_parts, validate=None, **kwargs):
+        """
+        发送一次图像分析请求并返回回复文本；缓存命中时不发送请求。
+
+        cache_parts 为除模型和消息以外参与缓存键计算的内容（如图像的 base64 编码）。
+        给出 validate 时只缓存 validate(回复文本) 为真的回复，缓存中不符合的旧回复会被忽略并重新请求。
+        """
+        cache_key = None
+        if self.cache is not None:
+            script = [m for m in messages if m["role"] == "assistant"]
+            cache_key = content_key("vision", self.model, self.image_detail, messages[0]["content"], self.lanuage,
+                                    json.dumps(script, ensure_ascii=False, sort_keys=True), *cache_parts)
+            cached = self.cache.get(cache_key)
+            if cached is not None and validate is not None and not validate(cached.decode("utf-8")):
+                self.logger.warning("缓存中的分析结果格式不符，重新请求。")
+                cached = None
+            if cached is not None:
+                self.logger.info("💾 命中分析缓存，跳过请求。")
+                self.metrics.count("vision_cache_hits")
+                return cached.decode("utf-8")
+        prompt_tokens = estimate_messages_tokens(messages)
+        self.network_requests += 1
+        with self.metrics.span("vision_request"):
+            response = self._create(
+                self.client.chat.completions,
+                tokens=prompt_tokens + 1200,
+                model=self.model,
+                messages=messages,
                 max_tokens=1200,
+                **kwargs,
             )
-            # 确保响应中包含预期的数据
-            if response.choices and len(response.choices) > 0 and response.choices[0].message:
-                return response.choices[0].message.content
-            else:
-                self.logger.error("响应缺少预期的数据。")
-                self.logger.info(f"响应内容: {response}")
+        usage = getattr(response, "usage", None)
+        self._count_usage("vision", messages, usage)
+        self.logger.info(f"📏 提示词预计 {prompt_tokens} tokens"
+                         + (f"，实际 {usage.prompt_tokens} tokens。" if usage else "。"))
+        # 确保响应中包含预期的数据
+        if response.choices and len(response.choices) > 0 and response.choices[0].message:
+            content = response.choices[0].message.content
+            if cache_key is not None and content and (validate is None or validate(content)):
+                self.cache.put(cache_key, content.encode("utf-8"))
+            return content
+        self.logger.error("响应缺少预期的数据。")
+        self.logger.info(f"响应内容: {response}")
+
+    def _count_usage(self, kind, messages, usage):
+        """记录一次对话请求的请求数、发送的字节数和 response.usage 中的 token 数。"""
+        self.metrics.count(f"{kind}_requests")
+        self.metrics.count(f"{kind}_request_bytes", len(json.dumps(messages, ensure_ascii=False).encode("utf-8")))
+        if usage is not None:
+            self.metrics.count(f"{kind}_prompt_tokens", usage.prompt_tokens)
+            self.metrics.count(f"{kind}_completion_tokens", usage.completion_tokens)
+
+    def analyze_image(self, base64_image, script):
+        try:
+            # self.logger.info(f"正在发送的图像数据: {self.generate_new_line(base64_image)}")
+            messages = [self._system_message()] + script + self.generate_new_line(base64_image)
+            return self._vision_request(messages, [base64_image])
         except Exception as e:
             self.logger.error(f"分析图像时发生错误: {e}")
-            self.logger.debug(f"错误详情:{response}")
-
-
-    def _openai_play_audio_with_chunking(self, text, voice="alloy"):
-        self.logger.info("🔊 Playing audio...")
-        narration_dir = os.path.join(os.getcwd(), "narration")
-        if not os.path.exists(narration_dir):
-            os.makedirs(narration_dir)
-            
-        # 将文本分成多个小块，每个不超过 4096 个字符
-        chunks = [text[i:i+4096] for i in range(0, len(text), 4096)]
-        self.total_chunks = len(chunks)
-
-        
-        # 用于存储生成的音频文件路径
-        self.latest_audio_path = []
-        
+            self.logger.debug("错误详情:", exc_info=True)
+
+    def generate_batch_line(self, base64_images):
+        content = [{
+            "type": "text",
+            "text": f"下面依次是视频中连续的 {len(base64_images)} 个画面。请为每个画面各写一段解说，"
+                    f"后一段接着前一段讲，不要重复。以 JSON 对象返回：{{\"narrations\": [\"第1个画面的解说\", ...]}}，"
+                    f"narrations 数组的长度必须是 {len(base64_images)}。",
+        }]
+        for base64_image in base64_images:
+            content.append({"type": "image_url", "image_url": self._image_url(base64_image)})
+        self.logger.info(f"🤖 AI is analyzing {len(base64_images)} images...")
+        return [{"role": "user", "content": content}]
+
+    def analyze_images(self, base64_images, script):
+        """
+        在一次请求中分析多个连续画面，返回与输入等长的解说列表。
+
+        回复无法解析或条数不符时，改为逐个画面单独分析。
+        """
+        try:
+            messages = [self._system_message()] + script + self.generate_batch_line(base64_images)
+            content = self._vision_request(messages, ["batch"] + list(base64_images),
+                                           validate=lambda c: _batch_narrations(c, len(base64_images)) is not None,
+                                           response_format={"type": "json_object"})
+            narrations = _batch_narrations(content, len(base64_images)) if content else None
+            if narrations is not None:
+                return [str(n).strip() or None for n in narrations]
+            self.logger.error("批量分析的回复无法解析或条数与画面数不符，改为逐个分析。")
+        except Exception as e:
+            self.logger.error(f"批量分析图像时发生错误: {e}，改为逐个分析。")
+        results = []
+        for base64_image in base64_images:
+            analysis = self.analyze_image(base64_image, script + [{"role": "assistant", "content": r}
+                                                                 for r in results if r])
+            results.append(analysis)
+        return results
+
+    def _output_dir(self):
+        return self.output_dir if self.output_dir else os.getcwd()
+
+    def _narration_dir(self):
+        narration_dir = os.path.join(self._output_dir(), "narration")
+        os.makedirs(narration_dir, exist_ok=True)
+        return narration_dir
+
+    def _run_id(self):
+        # 每次运行使用唯一的名称，多个任务共用 narration 目录时不会互相覆盖
+        return f"{time.strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+    def _check_voice(self, voice):
         # 检查 voice 参数是否有效
         valid_voices = ['nova', 'shimmer', 'echo', 'onyx', 'fable', 'alloy']
         if voice not in valid_voices:
             self.logger.error(f"无效的语音选择: {voice}. 将使用默认值 'alloy'.")
             voice = 'alloy'
-        
-        for chunk in chunks:
-            self.logger.info(f"正在生成第 {len(self.latest_audio_path) + 1} 个音频文件片段...")
-            try:
-                response = self.client.audio.speech.create(
-                    model="tts-1",
-                    voice=voice,
-                    input=chunk,
-                )
-            except Exception as e:
-                self.logger.error(f"生成音频文件片段时发生错误: {e}")
-                continue
-            
-            # 生成新的音频文件路径
-            speech_file_index = len(self.latest_audio_path) + 1
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            speech_file_path = os.path.join(narration_dir, f"speech_{speech_file_index}_{timestamp}.mp3")
-            
-            # 检查文件是否已经存在
-            if not os.path.exists(speech_file_path):
-                self.logger.info(f"正在保存第 {speech_file_index} 个音频文件片段到 {speech_file_path}...")
-                try:
-                    with open(speech_file_path, "wb") as f:
-                        f.write(response.content)
-                except Exception as e:
-                    self.logger.error(f"保存音频文件片段 {speech_file_path} 时发生错误: {e}")
-                    continue
-                self.latest_audio_path.append(speech_file_path)
-                self.logger.info("🎵 Audio saved to: %s", speech_file_path)
+        return voice
+
+    def _speech_audio(self, chunk, voice, speech_file_index):
+        """
+        合成一个不超过 4096 个字符的文本片段，返回音频字节，失败时返回 None。
+
+        音频按 (文本, 语音, 模型) 缓存在 audio_cache 中，相同的解说不会重复合成。
+        """
+        cache_key = content_key("tts", self.tts_model, voice, chunk)
+        audio = self.audio_cache.get(cache_key) if self.audio_cache is not None else None
+        if audio is not None:
+            self.logger.info(f"💾 第 {speech_file_index} 个音频文件片段命中缓存。")
+            self.metrics.count("tts_cache_hits")
+            return audio
+
+        self.logger.info(f"正在生成第 {speech_file_index} 个音频文件片段...")
+        try:
+            if self.work_queue is not None:
+                with self.metrics.span("remote_tts"):
+                    audio = base64.b64decode(self.work_queue.call(
+                        "tts", {"text": chunk, "voice": voice, "index": speech_file_index,
+                                "options": self._remote_options()}))
             else:
-                self.logger.info(f"文件 {speech_file_path} 已存在, 跳过生成.")
-                self.latest_audio_path.append(speech_file_path)
-            
-        self.logger.info("🎯 All audio files generated.")
-        
-        # 如果只有一个音频文件，就直接返回该文件路径
-        if len(self.latest_audio_path) == 1:
-            self.logger.info(f"🎉 Final audio file saved to: {self.latest_audio_path[0]}")
-            return self.latest_audio_path[0]
-        
-        # 合并所有音频文件
-        final_audio_path = os.path.join(narration_dir, f"final_narration_{timestamp}.mp3")
-        self.logger.info(f"正在合并 {len(self.latest_audio_path)} 个音频文件到 {final_audio_path}...")
-        self._merge_audio_files(self.latest_audio_path, final_audio_path)
-        
-        self.logger.info(f"🎉 Final audio file saved to: {final_audio_path}")
-        return final_audio_path
+                with self.metrics.span("tts_request"):
+                    response = self._create(
+                        self.client.audio.speech,
+                        model=self.tts_model,
+                        voice=voice,
+                        input=chunk,
+                    )
+                    audio = response.content
+        except Exception as e:
+            self.logger.error(f"生成音频文件片段时发生错误: {e}")
+            return None
+        self.metrics.count("tts_requests")
+        self.metrics.count("tts_characters", len(chunk))
+        self.metrics.count("tts_audio_bytes", len(audio))
+        if self.audio_cache is not None:
+            self.audio_cache.put(cache_key, audio)
+        return audio
+
+    def _iter_speech(self, chunks, voice, first_index=1):
+        """并发合成多个文本片段，按原顺序逐个产出音频字节（失败的片段为 None）。"""
+        if self.tts_concurrency <= 1 or len(chunks) <= 1:
+            for i, chunk in enumerate(chunks):
+                yield self._speech_audio(chunk, voice, first_index + i)
+            return
 
+        from concurrent.futures import ThreadPoolExecutor
 
+        with ThreadPoolExecutor(max_workers=min(self.tts_concurrency, len(chunks))) as executor:
+            yield from executor.map(lambda item: self._speech_audio(item[1], voice, first_index + item[0]),
+                                    enumerate(chunks))
 
+    def _synthesize_chunks(self, chunks, voice, output_dir, first_index=1):
+        """
+        合成多个文本片段并分别保存到 output_dir 中的 speech_<序号>.mp3，按原顺序返回成功生成的音频文件路径。
 
+        第 i 个片段的序号为 first_index + i，失败的片段也占用序号；多次调用时 first_index 应按片段数递增，
+        否则会覆盖之前的文件。
+        """
+        paths = []
+        for i, audio in enumerate(self._iter_speech(chunks, voice, first_index)):
+            if audio is None:
+                continue
+            speech_file_path = os.path.join(output_dir, f"speech_{first_index + i}.mp3")
+            try:
+                with self.metrics.span("audio_write"), open(speech_file_path, "wb") as f:
+                    f.write(audio)
+            except Exception as e:
+                self.logger.error(f"保存音频文件片段 {speech_file_path} 时发生错误: {e}")
+                continue
+            self.logger.info("🎵 Audio saved to: %s", speech_file_path)
+            paths.append(speech_file_path)
+        return paths
+
+    def _journaled_speech(self, chunks, voice):
+        """
+        与 _iter_speech 相同，但每个片段合成后保存到 narration/segments 并记入日志；
+        日志中已有且文件仍存在的片段直接读取，不再合成。
+        """
+        resumed = self.journal.begin("audio", {"voice": voice, "tts_model": self.tts_model})
+        done = {r["key"]: r["path"] for r in self.journal.records("audio") if os.path.exists(r["path"])} \
+            if resumed else {}
+        keys = [content_key(voice, chunk) for chunk in chunks]
+        missing = [chunk for chunk, key in zip(chunks, keys) if key not in done]
+        if len(missing) < len(chunks):
+            self.logger.info(f"📒 {len(chunks) - len(missing)} 个音频片段已在日志中，跳过合成。")
+        segments_dir = os.path.join(self._narration_dir(), "segments")
+        os.makedirs(segments_dir, exist_ok=True)
+        synthesized = self._iter_speech(missing, voice)
+        for key in keys:
+            if key in done:
+                with open(done[key], "rb") as f:
+                    yield f.read()
+                continue
+            audio = next(synthesized)
+            if audio is not None:
+                path = os.path.join(segments_dir, f"speech_{key[:16]}.mp3")
+                with self.metrics.span("audio_write"), open(path, "wb") as f:
+                    f.write(audio)
+                self.journal.append("audio", {"key": key, "path": path})
+            yield audio
+
+    def summarize_narrations(self, summary, narrations):
+        """将已有摘要和较早的解说压缩为一段简短的摘要，用于后续请求的上下文。"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = content_key("summary", self.model, self.lanuage, summary, *narrations)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached.decode("utf-8")
+        messages = [
+            {
+                "role": "system",
+                "content": f"请使用{self.lanuage}，把下面的纪录片解说压缩成一段不超过100字的摘要，"
+                           f"保留已经讲过的关键情节和笑点，以便之后的解说不再重复。",
+            },
+            {
+                "role": "user",
+                "content": "\n".join(([f"已有摘要：{summary}"] if summary else []) + narrations),
+            },
+        ]
+        with self.metrics.span("summary_request"):
+            response = self._create(
+                self.client.chat.completions,
+                tokens=1000,
+                model=self.model,
+                messages=messages,
+                max_tokens=300,
+            )
+        self._count_usage("summary", messages, getattr(response, "usage", None))
+        content = response.choices[0].message.content
+        if cache_key is not None and content:
+            self.cache.put(cache_key, content.encode("utf-8"))
+        return content
 
+    def _openai_play_audio_with_chunking(self, text, voice="alloy"):
+        self.logger.info("🔊 Playing audio...")
+        narration_dir = self._narration_dir()
 
+        # 按句子边界将文本分成多个小块，每个不超过 4096 个字符
+        chunks = split_sentences(text)
+        self.total_chunks = len(chunks)
 
+        voice = self._check_voice(voice)
+
+        # 每个片段合成完成后直接追加到最终文件，不产生中间文件
+        final_audio_path = os.path.join(narration_dir, f"final_narration_{self._run_id()}.mp3")
+        with AudioMerger(final_audio_path) as merger:
+            speech = self._iter_speech(chunks, voice) if self.journal is None else self._journaled_speech(chunks, voice)
+            for audio in speech:
+                if audio is not None:
+                    with self.metrics.span("audio_merge"):
+                        merger.append(audio)
+        if not merger.segments:
+            merger.discard()
+            self.logger.error("没有成功生成任何音频文件片段。")
+            self.latest_audio_path = []
+            return None
+
+        self.latest_audio_path = [final_audio_path]
+        self.logger.info(f"🎉 Final audio file saved to: {final_audio_path}")
+        return final_audio_path
 
+    def _timeline_speech(self, texts, voice):
+        """按顺序产出每段文本的音频字节；超过单次请求长度的文本分句合成后拼接，任一部分失败时为 None。"""
+        chunks = [split_sentences(text) for text in texts]
+        speech = self._iter_speech([chunk for parts in chunks for chunk in parts], voice)
+        for parts in chunks:
+            audio = [next(speech) for _ in parts]
+            if not audio or any(a is None for a in audio):
+                yield None
+            else:
+                yield audio[0] if len(audio) == 1 else b"".join(mp3_frames(a) for a in audio)
+
+    def _render_timeline(self, results):
+        """
+        用 (帧记录, 解说) 生成时间线并渲染音频，字幕和时间线保存在 narration 目录。
+
+        narration/timeline.json 中已有相同帧、相同文本和语音的片段时复用其音频，只合成变化的片段。
+        """
+        narration_dir = self._narration_dir()
+        timeline_path = os.path.join(narration_dir, "timeline.json")
+        timeline = Timeline.from_frames(results, voice=self._check_voice(self.voice_id), tts_model=self.tts_model,
+                                        duration=self.video_duration)
+        if os.path.exists(timeline_path):
+            try:
+                timeline.merge_previous(Timeline.load(timeline_path))
+            except (ValueError, KeyError) as e:
+                self.logger.error(f"读取上次的时间线时发生错误: {e}，重新合成全部片段。")
+        self.total_chunks = len(timeline.segments)
+        final_audio_path = os.path.join(narration_dir, f"final_narration_{self._run_id()}.mp3")
+        with self.metrics.span("timeline_render"):
+            stats = timeline.render(self._timeline_speech, os.path.join(narration_dir, "segments"),
+                                    final_audio_path, logger=self.logger)
+        timeline.save(timeline_path)
+        subtitles = timeline.export_subtitles(os.path.join(narration_dir, "timeline"))
+        self.metrics.count("timeline_segments_synthesized", stats["synthesized"])
+        self.metrics.count("timeline_segments_reused", stats["reused"])
+        if stats["output"] is None:
+            self.logger.error("没有成功生成任何音频文件片段。")
+            self.latest_audio_path = []
+            return None
+        self.latest_audio_path = [final_audio_path]
+        self.logger.info(f"🎉 Final audio file saved to: {final_audio_path}（{stats['duration']:.1f} 秒，"
+                         f"合成 {stats['synthesized']} 个片段，复用 {stats['reused']} 个），字幕: {subtitles[0]}")
+        return final_audio_path
 
     def _merge_audio_files(self, input_files, output_file):
-        """将多个音频文件合并为一个文件"""
-        import subprocess
-
-        # 创建一个包含所有音频文件路径的文本文件
-        concat_file = os.path.join("narration", "concat.txt")
+        """将多个音频文件合并为一个文件，成功后删除输入文件"""
         try:
-            with open(concat_file, "w") as f:
+            with AudioMerger(output_file) as merger:
                 for file_path in input_files:
-                    f.write(f"file '{file_path}'\n")
+                    with self.metrics.span("audio_merge"):
+                        merger.append(file_path)
         except Exception as e:
-            self.logger.error(f"创建 concat.txt 文件时发生错误: {e}")
-            return
-
-        # 使用 ffmpeg 命令合并音频文件
-        try:
-            subprocess.run(["ffmpeg", "-f", "concat", "-safe", "0", "-i", concat_file, "-c", "copy", output_file], check=True)
-        except subprocess.CalledProcessError as e:
             self.logger.error(f"合并音频文件时发生错误: {e}")
             return
 
-        # 删除临时文件
-        self._delete_files([concat_file] + input_files, max_retries=3, retry_delay=0.5)
-
+        self._delete_files(input_files, max_retries=3, retry_delay=0.5)
 
     def _delete_files(self, file_paths, max_retries=3, retry_delay=0.5):
         """尝试删除文件,如果失败则重试"""
         for file_path in file_paths:
-            num_retries = 0
-            while num_retries < max_retries:
+            for attempt in range(1, max_retries + 1):
                 try:
                     os.remove(file_path)
                     break
+                except FileNotFoundError:
+                    break
                 except OSError as e:
                     self.logger.error(f"删除文件 {file_path} 时发生错误: {e}")
-                    num_retries += 1
-                    if num_retries < max_retries:
+                    if attempt < max_retries:
                         self.logger.info(f"正在重试删除文件 {file_path}...")
                         time.sleep(retry_delay)
                     else:
-                        self.logger.info(f"已成功删除文件 {file_path}")
+                        self.logger.error(f"删除文件 {file_path} 失败，已放弃。")
 
+    def get_latest_audio_path(self):
+        return self.latest_audio_path
 
+    def _frame_base64(self, frame):
+        """帧记录中有内存图像（image）时直接编码，否则读取 path 指向的文件。"""
+        with self.metrics.span("base64_encode"):
+            if frame.get("image") is not None:
+                return base64.b64encode(frame["image"]).decode("utf-8")
+            return self.encode_image(frame["path"])
 
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
 
-    def get_latest_audio_path(self):
-        return self.latest_audio_path
+    def _wait(self, seconds):
+        # 可被取消的等待
+        if self.cancel_event is not None:
+            self.cancel_event.wait(seconds)
+        else:
+            time.sleep(seconds)
+
+    @staticmethod
+    def _frame_key(frame):
+        # 日志中标识一帧：优先使用帧序号，目录中的图像使用文件名
+        return frame["index"] if frame.get("index") is not None else os.path.basename(frame["path"])
+
+    def _analyze_batch(self, batch, script):
+        """分析一批连续的帧，返回与 batch 等长的分析结果列表；日志中已有结果的帧不再请求。"""
+        results = [self._journaled.get(self._frame_key(f)) for f in batch]
+        missing = [f for f, result in zip(batch, results) if result is None]
+        if not missing:
+            self.logger.debug(f"📒 {len(batch)} 帧的分析结果已在日志中，跳过请求。")
+            return results
+        labels = [os.path.basename(f["path"]) if f.get("path") else f"帧 {f.get('index')}" for f in missing]
+        self.logger.info(f"👀 正在分析: {', '.join(labels)}...")
+        if self.work_queue is not None:
+            analyses = self._remote_analyses(missing, script)
+        elif len(missing) == 1:
+            analyses = [self.analyze_image(self._frame_base64(missing[0]), script=script)]
+        else:
+            analyses = self.analyze_images([self._frame_base64(f) for f in missing], script=script)
+        analyses = iter(analyses)
+        for i, result in enumerate(results):
+            if result is None:
+                results[i] = next(analyses)
+                if results[i] and self.journal is not None:
+                    self.journal.append("analysis", {"frame": self._frame_key(batch[i]), "text": results[i]})
+        return results
+
+    def _remote_options(self):
+        # worker 按这些参数创建（或复用）自己的 ImageAnalyzer
+        return {"model": self.model, "language": self.lanuage, "detail": self.image_detail,
+                "tts_model": self.tts_model}
+
+    def _remote_analyses(self, frames, script):
+        """把一批帧作为一个任务提交到 work_queue 并等待结果，失败时每帧的结果为 None。"""
+        payload = {"frames": [{"index": f.get("index"), "timestamp": f.get("timestamp"), "path": f.get("path")}
+                              for f in frames],
+                   "script": script, "options": self._remote_options()}
+        if self.work_queue.inline_images:
+            payload["images"] = [self._frame_base64(f) for f in frames]
+        try:
+            self.network_requests += 1
+            with self.metrics.span("remote_vision"):
+                analyses = self.work_queue.call("vision", payload)
+        except Exception as e:
+            self.logger.error(f"远程分析图像时发生错误: {e}")
+            return [None] * len(frames)
+        self.metrics.count("remote_vision_jobs")
+        return analyses
+
+    def analyze_frames(self, frames, concurrency=1, context_size=None, batch_size=1):
+        """
+        按帧顺序分析多帧，逐个产出 (帧记录, 分析结果)，分析失败时结果为 None。
+
+        参数:
+        - frames: 帧记录的可迭代对象（包含 path 或 image），可以是惰性的。
+        - concurrency: 同时进行中的请求数。为1时逐个请求，实际发出请求并成功后等待 request_interval 秒；
+          大于1时由线程池并发请求，进行中的请求数即为限流窗口，结果仍按帧顺序产出。
+        - context_size: 每个请求完整附带的最近解说条数，默认为8；更早的解说汇总为摘要，
+          总量受 context_tokens 预算限制。并发时每个请求只能看到提交时已按顺序完成的解说。
+        - batch_size: 每个请求包含的连续帧数，默认为1；大于1时系统提示和历史解说只需发送一次，
+          回复按帧拆分。
+        """
+        narrations = NarrationContext(max_tokens=self.context_tokens, window=context_size or 8,
+                                      summarize=self.summarize_narrations, logger=self.logger)
+        self._journaled = {}
+        if self.journal is not None and self.journal.begin(
+                "analysis", {"model": self.model, "language": self.lanuage, "detail": self.image_detail}):
+            self._journaled = {r["frame"]: r["text"] for r in self.journal.records("analysis")}
+            if self._journaled:
+                self.logger.info(f"📒 从日志恢复了 {len(self._journaled)} 帧的分析结果。")
+
+        def batches():
+            batch = []
+            for frame in frames:
+                batch.append(frame)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+        if concurrency <= 1:
+            for batch in batches():
+                if self.cancelled():
+                    return
+                sent = self.network_requests
+                results = self._analyze_batch(batch, narrations.messages())
+                for frame, analysis in zip(batch, results):
+                    if analysis:
+                        narrations.add(analysis)
+                    yield frame, analysis
+                # 只在实际发出请求后等待，命中缓存或日志的帧不需要限速
+                if any(results) and self.network_requests != sent:
+                    self._wait(self.request_interval)  # 根据需要调整等待时间
+            return
 
-    def main(self,voice="alloy"):
-        script = []
-        time.sleep(3)
-        frames_dir = os.path.join(os.getcwd(), "video_frames")
-        frame_files = [f for f in sorted(os.listdir(frames_dir)) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+        from collections import deque
+        from concurrent.futures import ThreadPoolExecutor
+
+        batch_iter = batches()
+        pending = deque()
+        exhausted = False
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while pending or not exhausted:
+                # 填满进行中的请求窗口
+                while not exhausted and len(pending) < concurrency:
+                    batch = next(batch_iter, None) if not self.cancelled() else None
+                    if batch is None:
+                        exhausted = True
+                        break
+                    pending.append((batch, executor.submit(self._analyze_batch, batch, narrations.messages())))
+                if pending:
+                    batch, future = pending.popleft()
+                    for frame, analysis in zip(batch, future.result()):
+                        if analysis:
+                            narrations.add(analysis)
+                        yield frame, analysis
+
+    def main(self,voice="alloy", frames=None, concurrency=1, context_size=None, batch_size=1):
+        """
+        分析帧图像并生成解说音频。
+
+        参数:
+        - voice: 语音ID。
+        - frames: 需要分析的帧记录列表（如 dedup_frames 的结果），默认分析 video_frames 目录中的全部图像。
+        - concurrency: 同时进行中的分析请求数，默认为1（逐帧）。
+        - context_size: 每个请求完整附带的最近解说条数，默认为8。
+        - batch_size: 每个请求包含的连续帧数，默认为1。
+
+        结束时将 metrics 导出到 output_dir 下的 metrics 目录，设置了 profile_path 时同时写入 cProfile 结果。
+        """
+        with profile(self.profile_path):
+            try:
+                self._main(voice, frames, concurrency, context_size, batch_size)
+            finally:
+                self.export_metrics()
 
-        self.logger.info(f"找到 {len(frame_files)} 个图像文件进行分析。")
+    def export_metrics(self):
+        """将 metrics 导出为 metrics 目录下的 JSON 报告和 Prometheus 文本文件，返回两个文件路径。"""
+        try:
+            paths = self.metrics.export(os.path.join(self._output_dir(), "metrics", f"metrics_{self._run_id()}"))
+        except Exception as e:
+            self.logger.error(f"导出统计数据时发生错误: {e}")
+            return None
+        counters = self.metrics.report()["counters"]
+        self.logger.info(f"📊 图像分析 {counters.get('vision_requests', 0)} 次请求，"
+                         f"输入 {counters.get('vision_prompt_tokens', 0)} tokens，"
+                         f"输出 {counters.get('vision_completion_tokens', 0)} tokens；"
+                         f"语音合成 {counters.get('tts_characters', 0)} 个字符。统计数据已保存到: {paths[0]}")
+        pool = self.http_pool.stats()
+        self.logger.info(f"🔌 连接池共发送 {pool['requests']} 个请求，新建 {pool['connections_opened']} 个连接，"
+                         f"并发峰值 {pool['peak_in_flight']}，HTTP/2 连接 {pool['http2_connections']} 个。")
+        return paths
+
+    def _main(self, voice, frames, concurrency, context_size, batch_size):
+        if frames is None:
+            # 扫描 video_frames 目录前稍等片刻，让仍在写入的帧文件完成；给出帧列表或从日志恢复时不需要等待
+            if self.journal is None or not self.journal.records("analysis"):
+                self._wait(3)
+            frames_dir = os.path.join(self._output_dir(), "video_frames")
+            frames = [{"path": os.path.join(frames_dir, f)} for f in sorted(os.listdir(frames_dir))
+                      if f.lower().endswith(('.png', '.jpg', '.jpeg', '.webp'))]
+
+        self.logger.info(f"找到 {len(frames)} 个图像文件进行分析。")
 
         ai_message = ''
-        for index, frame_file in enumerate(frame_files):
-            frame_path = os.path.join(frames_dir, frame_file)
-            base64_image = self.encode_image(frame_path)
-            # 为了提高日志的可读性，我们可以在日志中添加文件索引和名称
-            self.logger.info(f"👀 正在分析第 {index + 1}/{len(frame_files)} 个文件: {frame_file}...")
-            analysis = self.analyze_image(base64_image, script=script)
-
+        failed = 0
+        results = []
+        for index, (frame, analysis) in enumerate(
+                self.analyze_frames(frames, concurrency, context_size, batch_size)):
+            results.append((frame, analysis))
             if analysis:  # 确保分析结果不为空
-                self.logger.info("🎙️ 分析结果:")
+                self.logger.info(f"🎙️ 第 {index + 1}/{len(frames)} 个文件的分析结果:")
                 self.logger.info(analysis)
-                script.append({"role": "assistant", "content": analysis})
                 ai_message += analysis + " "  # 添加空格以分隔不同帧的分析结果
-                time.sleep(5)  # 根据需要调整等待时间
             else:
-                self.logger.info("没有获取到分析结果。")
+                failed += 1
+                self.logger.error(f"第 {index + 1}/{len(frames)} 个文件没有获取到分析结果。")
+            if self.progress_callback is not None:
+                self.progress_callback(index + 1, len(frames))
+        self.ai_message = ai_message
+        if failed:
+            self.logger.error(f"共有 {failed} 个文件在重试后仍未获得分析结果。")
+
+        if self.cancelled():
+            self.logger.info("处理已取消，不生成音频。")
+            return
+
+        if self.cache is not None:
+            stats = self.cache.stats()
+            self.logger.info(f"分析缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次。")
 
         # 检查ai_message是否为空，避免尝试播放空消息
+        if ai_message and self.timeline:
+            if all(frame.get("timestamp") is not None for frame, _ in results):
+                self._render_timeline(results)
+                return
+            self.logger.error("帧记录缺少时间，无法生成时间线，改为合成完整的解说。")
         if ai_message:
             self._openai_play_audio_with_chunking(text=ai_message,voice=self.voice_id)
         else:
@@ -1,12 +1,15 @@
 # coding: utf-8
 import shutil
+import time
 
 import cv2
 import os
-from PIL import Image
-import numpy as np
 import logging
 
+from frame_filter import frame_descriptor, select_diverse
+from metrics import Metrics
+from preprocess import FramePreprocessor, estimate_image_tokens
+
 # 设置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -25,21 +28,324 @@ def clear_directory(directory):
                 shutil.rmtree(file_path)
         except Exception as e:
             print(f'删除 {file_path} 时发生错误。原因: {e}')
-def extract_frames(video_path, folder="video_frames", frame_interval=2):
+
+
+# 采样模式：
+# - "seek": 通过 CAP_PROP_POS_FRAMES 直接跳到目标帧（由解码器从最近的关键帧开始解码），
+#   间隔较小时自动退化为 grab；若容器不支持精确定位则回退到 "grab"
+# - "grab": 用 grab() 跳过不需要的帧（不做 retrieve 和颜色转换），只解码保留的帧
+# - "read": 旧行为，逐帧 read()
+SAMPLING_MODES = ("seek", "grab", "read")
+
+# 目标帧之间的间隔小于该帧数时，seek 的关键帧回溯开销大于顺序 grab，直接使用 grab
+SEEK_MIN_GAP = 48
+
+
+def _sample_indices(fps, total_frames, frame_interval):
+    """
+    计算需要保留的帧序号。
+
+    按时间点 k * frame_interval 取最近的帧，支持非整数帧率和小于1秒的间隔；
+    间隔小于一帧时每帧都保留。total_frames 未知（<= 0）时不设上限，由调用方在读到视频末尾时停止。
+    """
+    step = max(fps * frame_interval, 1.0)
+    k = 0
+    while True:
+        index = int(round(k * step))
+        if 0 < total_frames <= index:
+            return
+        yield index
+        k += 1
+
+
+def _seek(cap, index):
+    """将 cap 定位到指定帧序号，返回定位后的位置是否与目标一致。"""
+    return cap.set(cv2.CAP_PROP_POS_FRAMES, index) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index
+
+
+def _reopen(cap, video_path):
+    """重新打开视频，使 cap 回到第0帧；打开失败或位置不是0时抛出 IOError。"""
+    if not cap.open(video_path) or int(cap.get(cv2.CAP_PROP_POS_FRAMES)) != 0:
+        raise IOError("无法重新打开视频文件")
+
+
+def _rewind(cap, position, video_path):
+    """
+    定位不准确时把 cap 退回到上一个确认过的位置 position，返回退回后的帧序号。
+
+    先定位到 position 的前一帧并读取，读完后的位置等于 position 才算成功；否则重新打开视频，返回0。
+    video_path 为空、无法重新打开时返回 None。
+    """
+    if position > 0 and _seek(cap, position - 1):
+        ret, _ = cap.read()
+        if ret and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == position:
+            return position
+    if video_path is None:
+        return None
+    _reopen(cap, video_path)
+    return 0
+
+
+def _iter_sampled_frames(cap, indices, sampling, stats, video_path=None, position=0, metrics=None):
+    """
+    按帧序号从 cap 中取出帧，产出 (帧序号, 帧) 。
+
+    position 为 cap 当前所在的帧序号。stats 会被原地更新：grabbed 为只 grab 未解码的帧数，
+    decoded 为完整解码的帧数，seeks 为成功定位的次数。定位成功但读不到帧时视为已到视频末尾
+    （CAP_PROP_FRAME_COUNT 常被高估）；定位后的位置不对时退回上一个确认的位置，之后以 grab 方式继续。
+    metrics 不为空时，取出每个采样帧的耗时（含定位和跳过的帧）记为 frame_decode。
+    """
+    fallback = False
+    for index in indices:
+        started = time.perf_counter()
+        if sampling == "seek" and index - position > SEEK_MIN_GAP:
+            if _seek(cap, index):
+                ret, frame = cap.read()
+                stats["decoded"] += 1
+                if not ret:
+                    return
+                # 读完后的位置应当紧跟目标帧，否则说明容器定位不准确
+                if int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == index + 1:
+                    stats["seeks"] += 1
+                    position = index + 1
+                    if metrics is not None:
+                        metrics.observe("frame_decode", time.perf_counter() - started)
+                    yield index, frame
+                    continue
+            # 定位失败也可能只是目标帧超出了视频末尾，先从上一个确认的位置 grab 过去，取到帧后才确认回退
+            position = _rewind(cap, position, video_path)
+            if position is None:
+                return
+            sampling = "grab"
+            fallback = True
+
+        if sampling == "read":
+            while position < index:
+                ret, _ = cap.read()
+                stats["decoded"] += 1
+                if not ret:
+                    return
+                position += 1
+        else:
+            while position < index:
+                if not cap.grab():
+                    return
+                stats["grabbed"] += 1
+                position += 1
+
+        ret, frame = cap.read()
+        if not ret:
+            return
+        stats["decoded"] += 1
+        position += 1
+        if fallback:
+            logging.warning("视频定位不准确，回退到 grab 采样模式。")
+            stats["mode"] = "grab"
+            fallback = False
+        if metrics is not None:
+            metrics.observe("frame_decode", time.perf_counter() - started)
+        yield index, frame
+
+
+def _save_frame(frames_dir, frame_count, frame, fps, preprocessor, metrics):
+    """缩放、编码并保存一帧，返回该帧的记录。"""
+    with metrics.span("frame_preprocess"):
+        image, info = preprocessor.process(frame)
+
+    # 将帧作为图像文件保存
+    path = f"{frames_dir}/frame_{frame_count}{preprocessor.extension}"
+    with metrics.span("frame_write"):
+        with open(path, "wb") as f:
+            f.write(image)
+    metrics.count("frames")
+    metrics.count("frame_bytes", info["bytes"])
+    logging.info(f"📸 正在保存帧 {frame_count}（{info['bytes'] / 1024:.1f} KB，约 {info['tokens']} tokens）.")
+    return {"index": frame_count, "timestamp": frame_count / fps, "path": path,
+            "bytes": info["bytes"], "tokens": info["tokens"]}
+
+
+def _new_stats(sampling):
+    return {"mode": sampling, "decoded": 0, "grabbed": 0, "seeks": 0, "kept": 0, "resumed": 0, "budget": None,
+            "frames": []}
+
+
+def _resumed_frames(journal, video_path, frame_interval, frames_dir, preprocessor, budget=None):
+    """
+    返回日志中已保存且文件仍存在的帧（帧序号 → 帧记录）；没有日志或提取参数变化时返回空字典。
+    """
+    if journal is None:
+        return {}
+    config = {"video": os.path.abspath(video_path), "size": os.path.getsize(video_path),
+              "mtime": os.path.getmtime(video_path), "frame_interval": frame_interval, "frames_dir": frames_dir,
+              "max_edge": preprocessor.max_edge, "codec": preprocessor.codec, "quality": preprocessor.quality}
+    if budget is not None:
+        config["budget"] = budget
+    if not journal.begin("extract", config):
+        return {}
+    return {r["frame"]["index"]: r["frame"] for r in journal.records("extract")
+            if "frame" in r and os.path.exists(r["frame"]["path"])}
+
+
+def _budget_indices(video_path, indices, sampling, fps, preprocessor, max_frames, max_tokens, metrics):
+    """
+    预算模式：先按 indices 密集采样并计算每帧的描述子（不编码、不保存），再用 select_diverse 选出预算内的帧。
+
+    帧数上限取 max_frames 和 max_tokens 折算的帧数中较小的一个，每帧的 token 数按预处理后的尺寸估算。
+    max_tokens 小于一帧的 token 数时不选任何帧（并记录错误），不会超出预算。
+
+    返回:
+    - (选中的帧序号列表, 统计字典：candidates、selected、tokens_per_frame、radius、decoded、grabbed、seconds)。
+    """
+    started = time.perf_counter()
+    stats = _new_stats(sampling)
+    frame_numbers, descriptors = [], []
+    tokens_per_frame = None
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise IOError("无法打开视频文件")
+        for frame_count, frame in _iter_sampled_frames(cap, indices, sampling, stats, video_path, metrics=metrics):
+            if tokens_per_frame is None:
+                height, width = preprocessor.resize(frame).shape[:2]
+                tokens_per_frame = estimate_image_tokens(width, height, preprocessor.detail)
+                if max_tokens and max_tokens < tokens_per_frame:
+                    # 一帧也放不下，不必继续解码候选帧
+                    break
+            with metrics.span("frame_describe"):
+                descriptors.append(frame_descriptor(frame))
+            frame_numbers.append(frame_count)
+    finally:
+        cap.release()
+
+    limits = [n for n in (max_frames, max_tokens // tokens_per_frame if max_tokens and tokens_per_frame else None)
+              if n is not None]
+    k = min(limits) if limits else len(frame_numbers)
+    if k <= 0:
+        logging.error(f"token 预算 {max_tokens} 小于每帧约 {tokens_per_frame} tokens，不提取任何帧；"
+                      f"请增大 --max-tokens 或减小帧的尺寸。")
+    chosen, radius = select_diverse(descriptors, k, timestamps=[n / fps for n in frame_numbers])
+    info = {"candidates": len(frame_numbers), "selected": len(chosen), "tokens_per_frame": tokens_per_frame,
+            "radius": round(radius, 4), "decoded": stats["decoded"], "grabbed": stats["grabbed"],
+            "seconds": round(time.perf_counter() - started, 3)}
+    logging.info(f"预算模式：从 {info['candidates']} 个候选帧中选出 {info['selected']} 帧"
+                 f"（每帧约 {tokens_per_frame} tokens），覆盖半径 {info['radius']}。")
+    return [frame_numbers[i] for i in chosen], info
+
+
+def _extract_range(video_path, frames_dir, indices, sampling, fps, preprocessor):
+    """
+    工作进程入口：用独立的 VideoCapture 提取 indices 对应的一段帧。
+
+    先直接定位到本段的第一帧，定位失败时从头顺序 grab。返回该段的统计信息，
+    其中 metrics 为本进程的 Metrics.state()，由主进程合并。
+    """
+    stats = _new_stats(sampling)
+    metrics = Metrics()
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise IOError("无法打开视频文件")
+        position = 0
+        if indices[0] > 0:
+            if _seek(cap, indices[0]):
+                stats["seeks"] += 1
+                position = indices[0]
+            else:
+                # 定位失败后 cap 停在未知的位置，重新打开后才能从第0帧开始计数
+                _reopen(cap, video_path)
+        for frame_count, frame in _iter_sampled_frames(cap, indices, sampling, stats, video_path, position,
+                                                       metrics):
+            stats["frames"].append(_save_frame(frames_dir, frame_count, frame, fps, preprocessor, metrics))
+            stats["kept"] += 1
+    finally:
+        cap.release()
+    stats["metrics"] = metrics.state()
+    return stats
+
+
+def _extract_parallel(video_path, frames_dir, indices, sampling, fps, workers, preprocessor, metrics):
+    """
+    将 indices 按时间切分为 workers 段，每段由一个进程独立解码，结果按时间顺序合并。
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    indices = list(indices)
+    if not indices:
+        return _new_stats(sampling)
+    workers = max(1, min(workers, len(indices)))
+    size = -(-len(indices) // workers)
+    ranges = [indices[i:i + size] for i in range(0, len(indices), size)]
+    logging.info(f"使用 {len(ranges)} 个进程并行提取帧。")
+
+    stats = _new_stats(sampling)
+    # 用 spawn 启动工作进程：runner 会在多个线程中同时提取帧，fork 时其他线程持有的锁（日志、连接池）
+    # 会被复制到子进程中且永远不会释放，子进程写日志时可能死锁
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [executor.submit(_extract_range, video_path, frames_dir, r, sampling, fps, preprocessor) for r in ranges]
+        for future in futures:
+            part = future.result()
+            for key in ("decoded", "grabbed", "seeks", "kept"):
+                stats[key] += part[key]
+            metrics.merge(part.pop("metrics"))
+            if part["mode"] != sampling:
+                stats["mode"] = part["mode"]
+            stats["frames"].extend(part["frames"])
+    stats["frames"].sort(key=lambda f: f["index"])
+    return stats
+
+
+def extract_frames(video_path, folder="video_frames", frame_interval=2, sampling="seek", workers=1,
+                   cancel_event=None, preprocessor=None, metrics=None, journal=None, max_frames=None, max_tokens=None):
     """
     从视频中提取帧并保存为图像文件。
 
     参数:
     - video_path: 视频文件的路径。
     - folder: 存储帧图像的文件夹名称，默认为"video_frames"。
-    - frame_interval: 提取帧的时间间隔（秒），默认为2秒。
+    - frame_interval: 提取帧的时间间隔（秒），默认为2秒，可以是小数。
+    - sampling: 采样模式，"seek"、"grab" 或 "read"，默认为"seek"。
+    - workers: 并行解码的进程数，默认为1（串行）；小于等于0时使用全部CPU核心。
+      输出的文件与串行方式完全相同。
+    - cancel_event: 可选的 threading.Event，设置后停止提取（仅串行方式）。
+    - preprocessor: FramePreprocessor，控制缩放尺寸、编码格式和质量，默认为最长边250像素的 JPEG。
+    - metrics: 可选的 Metrics，记录解码、预处理和写文件的耗时。
+    - journal: 可选的 Journal。日志中已保存且文件仍存在的帧不再提取，也不清空帧文件夹；
+      视频或预处理参数变化时重新提取。
+    - max_frames: 整个视频最多保存的帧数。设置了 max_frames 或 max_tokens 时进入预算模式：
+      先按 frame_interval 密集采样计算廉价的画面描述子，再选出最有代表性且差异最大的帧，只保存这些帧，
+      因此每个视频的分析成本有固定上限，与视频长度无关。
+    - max_tokens: 整个视频的图像 token 预算，按预处理后的图像尺寸折算为帧数（不含提示词和历史解说的 token）。
+
+    返回:
+    - 统计信息字典：mode、decoded（完整解码帧数）、grabbed（跳过未解码帧数）、seeks、kept（保存帧数）、
+      resumed（从日志恢复的帧数）、budget（预算模式的统计，见 _budget_indices，否则为 None）、frames（按时间排序的每个保存帧的 index、timestamp 秒、path、bytes
+      和估算的图像 tokens，包含从日志恢复的帧）。
     """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"未知的采样模式: {sampling}")
+
+    stats = _new_stats(sampling)
+    preprocessor = preprocessor if preprocessor is not None else FramePreprocessor()
+    metrics = metrics if metrics is not None else Metrics()
+    cap = None
     try:
+        frame_interval = float(frame_interval)
+        if frame_interval <= 0:
+            raise ValueError("帧提取的时间间隔必须大于0")
+        workers = int(workers)
+        if workers <= 0:
+            workers = os.cpu_count() or 1
+
         # 创建帧文件夹（如果不存在的话）
         frames_dir = os.path.join(os.getcwd(), folder)
+        budget = {"max_frames": max_frames, "max_tokens": max_tokens} if max_frames or max_tokens else None
+        resumed = _resumed_frames(journal, video_path, frame_interval, frames_dir, preprocessor, budget)
         os.makedirs(frames_dir, exist_ok=True)
         if not os.path.exists(frames_dir):
             os.makedirs(frames_dir)
+        elif resumed:
+            logging.info(f"从日志恢复了 {len(resumed)} 帧，只提取缺少的帧。")
         else:
             # 如果目录已存在，清空该目录
             clear_directory(frames_dir)
@@ -53,43 +359,119 @@ def extract_frames(video_path, folder="video_frames", frame_interval=2):
             raise IOError("无法打开视频文件")
 
         fps = cap.get(cv2.CAP_PROP_FPS)  # 获取视频的帧率
-        interval_frames = int(fps * frame_interval)  # 计算间隔的帧数
+        if not fps or fps <= 0:
+            raise IOError("无法获取视频帧率")
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        indices = _sample_indices(fps, total_frames, frame_interval)
+        if budget is not None:
+            indices, budget_stats = _budget_indices(video_path, indices, sampling, fps, preprocessor, max_frames,
+                                                    max_tokens, metrics)
+        if resumed:
+            indices = (i for i in indices if i not in resumed)
+
+        if workers > 1 and total_frames <= 0:
+            logging.warning("无法获取视频总帧数，改为串行提取。")
+            workers = 1
 
-        frame_count = 0  # 用于计数和决定是否保存帧
+        if workers > 1:
+            # 每个进程使用自己的 VideoCapture
+            cap.release()
+            cap = None
+            stats = _extract_parallel(video_path, frames_dir, indices, sampling, fps, workers, preprocessor,
+                                      metrics)
+            if journal is not None:
+                for frame in stats["frames"]:
+                    journal.append("extract", {"frame": frame})
+        else:
+            for frame_count, frame in _iter_sampled_frames(cap, indices, sampling, stats, video_path,
+                                                           metrics=metrics):
+                if cancel_event is not None and cancel_event.is_set():
+                    logging.info("帧提取已取消。")
+                    break
+                stats["frames"].append(_save_frame(frames_dir, frame_count, frame, fps, preprocessor, metrics))
+                stats["kept"] += 1
+                if journal is not None:
+                    journal.append("extract", {"frame": stats["frames"][-1]})
 
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break  # 如果没有帧了，跳出循环
+        if budget is not None:
+            stats["budget"] = budget_stats
+        if resumed:
+            stats["resumed"] = len(resumed)
+            stats["frames"] = sorted(list(resumed.values()) + stats["frames"], key=lambda f: f["index"])
 
-            if frame_count % interval_frames == 0:
-                # 将捕获的帧转换成PIL图像格式
-                pil_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        logging.info(f"帧提取完成。采样模式: {stats['mode']}，解码 {stats['decoded']} 帧，"
+                     f"跳过 {stats['grabbed']} 帧，保存 {stats['kept']} 帧。")
 
-                # 调整图像大小
-                max_size = 250
-                ratio = max_size / max(pil_img.size)
-                new_size = tuple([int(x * ratio) for x in pil_img.size])
-                resized_img = pil_img.resize(new_size, Image.LANCZOS)
+    except Exception as e:
+        logging.error(f"提取帧过程中发生错误: {e}")
+    finally:
+        # 释放视频文件并关闭所有窗口
+        if cap is not None:
+            cap.release()
+        cv2.destroyAllWindows()
 
-                # 将PIL图像转换回OpenCV图像格式
-                frame = cv2.cvtColor(np.array(resized_img), cv2.COLOR_RGB2BGR)
+    return stats
 
-                # 将帧作为图像文件保存
-                path = f"{frames_dir}/frame_{frame_count}.jpg"
-                cv2.imwrite(path, frame)
-                logging.info(f"📸 正在保存帧 {frame_count}.")
 
-            frame_count += 1
+def iter_frames(video_path, frame_interval=2, sampling="seek", folder=None, preprocessor=None, stats=None,
+                metrics=None):
+    """
+    逐个产出采样帧，图像在内存中编码，不经过磁盘。
 
-        logging.info("帧提取完成。")
+    参数:
+    - video_path: 视频文件的路径。
+    - frame_interval: 提取帧的时间间隔（秒），可以是小数。
+    - sampling: 采样模式，"seek"、"grab" 或 "read"。
+    - folder: 同时将帧保存到该文件夹（不清空），默认不保存。
+    - preprocessor: FramePreprocessor，默认为最长边250像素的 JPEG。
+    - stats: 可选的统计信息字典，会被原地更新。
+    - metrics: 可选的 Metrics，记录解码、预处理和写文件的耗时。
 
-    except Exception as e:
-        logging.error(f"提取帧过程中发生错误: {e}")
+    产出:
+    - 帧记录字典：index、timestamp（秒）、path（未保存时为 None）、image（编码后的图像字节）、bytes、tokens。
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"未知的采样模式: {sampling}")
+    frame_interval = float(frame_interval)
+    if frame_interval <= 0:
+        raise ValueError("帧提取的时间间隔必须大于0")
+    stats = stats if stats is not None else _new_stats(sampling)
+    preprocessor = preprocessor if preprocessor is not None else FramePreprocessor()
+    metrics = metrics if metrics is not None else Metrics()
+
+    frames_dir = None
+    if folder:
+        frames_dir = os.path.join(os.getcwd(), folder)
+        os.makedirs(frames_dir, exist_ok=True)
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            raise IOError("无法打开视频文件")
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if not fps or fps <= 0:
+            raise IOError("无法获取视频帧率")
+        indices = _sample_indices(fps, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), frame_interval)
+
+        for frame_count, frame in _iter_sampled_frames(cap, indices, sampling, stats, video_path, metrics=metrics):
+            with metrics.span("frame_preprocess"):
+                image, info = preprocessor.process(frame)
+            path = None
+            if frames_dir:
+                path = f"{frames_dir}/frame_{frame_count}{preprocessor.extension}"
+                with metrics.span("frame_write"):
+                    with open(path, "wb") as f:
+                        f.write(image)
+            metrics.count("frames")
+            metrics.count("frame_bytes", info["bytes"])
+            stats["kept"] += 1
+            yield {"index": frame_count, "timestamp": frame_count / fps, "path": path, "image": image,
+                   "bytes": info["bytes"], "tokens": info["tokens"]}
+
+        logging.info(f"帧提取完成。采样模式: {stats['mode']}，解码 {stats['decoded']} 帧，"
+                     f"跳过 {stats['grabbed']} 帧，保存 {stats['kept']} 帧。")
     finally:
-        # 释放视频文件并关闭所有窗口
         cap.release()
-        cv2.destroyAllWindows()
 
 
 if __name__ == '__main__':
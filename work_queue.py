@@ -0,0 +1,228 @@
+# coding: utf-8
+import base64
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+import redis
+
+# 任务类型："vision" 分析一批帧，"tts" 合成一个文本片段
+JOB_KINDS = ("vision", "tts")
+
+# 所有 worker 共用的消费者组
+GROUP = "workers"
+
+
+class JobFailed(RuntimeError):
+    """worker 执行任务失败，或任务超过最大尝试次数后被放弃。"""
+
+
+class FrameQueue:
+    """
+    基于 Redis Stream 的任务队列，用于把图像分析和语音合成分发到多台机器上的 worker。
+
+    生产者用 submit 提交任务、用 result 等待结果；worker 用 claim 领取任务，完成后用 ack 回复结果并确认。
+    已领取但超过 visibility_timeout 秒仍未确认的任务（例如 worker 崩溃）会被其他 worker 重新领取，
+    尝试次数超过 max_attempts 时放弃该任务并向生产者回复错误。结果写入每个任务独立的回复列表，
+    生产者按提交顺序等待各任务的结果，因此结果顺序与提交顺序一致。
+
+    参数:
+    - client: redis.Redis 或兼容的客户端（如 fakeredis.FakeRedis）。
+    - name: 队列名称，作为所有键的前缀。
+    - visibility_timeout: 任务领取后多久未确认即视为 worker 已失效（秒），应大于单个请求（含限流重试）的最长耗时。
+    - max_attempts: 每个任务最多被领取的次数。
+    - reply_ttl: 回复列表的保留时间（秒），生产者不再等待的结果到期后自动删除。
+    - inline_images: 为 True 时任务中携带图像数据；为 False 时只携带帧路径，要求 worker 能访问相同的文件系统。
+    - result_timeout: 生产者等待单个任务结果的最长时间（秒），None 表示一直等待。
+    """
+
+    def __init__(self, client, name="narrator", visibility_timeout=900, max_attempts=3, reply_ttl=3600,
+                 inline_images=True, result_timeout=None, logger=None):
+        self.client = client
+        self.name = name
+        self.stream = f"{name}:jobs"
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.reply_ttl = reply_ttl
+        self.inline_images = inline_images
+        self.result_timeout = result_timeout
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        try:
+            client.xgroup_create(self.stream, GROUP, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @classmethod
+    def from_url(cls, url, **options):
+        """按 Redis URL（如 redis://localhost:6379/0）创建队列。"""
+        return cls(redis.Redis.from_url(url), **options)
+
+    def _reply_key(self, job_id):
+        return f"{self.name}:reply:{job_id}"
+
+    def _attempts_key(self):
+        return f"{self.name}:attempts"
+
+    def submit(self, kind, payload):
+        """提交一个任务，返回任务 ID。payload 必须可以序列化为 JSON。"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"未知的任务类型: {kind}")
+        job_id = uuid.uuid4().hex
+        self.client.xadd(self.stream, {"id": job_id, "kind": kind,
+                                       "payload": json.dumps(payload, ensure_ascii=False)})
+        return job_id
+
+    def result(self, job_id, timeout=None):
+        """
+        等待任务的结果并返回；worker 回复错误时抛出 JobFailed，超时抛出 TimeoutError。
+
+        参数:
+        - timeout: 等待时间（秒），默认使用 result_timeout。
+        """
+        timeout = self.result_timeout if timeout is None else timeout
+        reply = self.client.blpop(self._reply_key(job_id), timeout=timeout or 0)
+        if reply is None:
+            raise TimeoutError(f"等待任务 {job_id} 的结果超时")
+        reply = json.loads(reply[1])
+        if reply.get("error") is not None:
+            raise JobFailed(reply["error"])
+        return reply["result"]
+
+    def call(self, kind, payload, timeout=None):
+        """提交任务并等待结果。"""
+        return self.result(self.submit(kind, payload), timeout)
+
+    def _job(self, entry_id, fields):
+        fields = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                  for k, v in fields.items()}
+        entry_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+        attempts = self.client.hincrby(self._attempts_key(), entry_id, 1)
+        return {"id": fields["id"], "entry": entry_id, "kind": fields["kind"],
+                "payload": json.loads(fields["payload"]), "attempts": attempts}
+
+    def claim(self, consumer, block=1.0):
+        """
+        领取一个任务，返回任务字典（id、entry、kind、payload、attempts），block 秒内没有任务时返回 None。
+
+        优先重新领取其他 worker 超时未确认的任务；超过 max_attempts 的任务直接回复错误并确认，不再返回。
+        """
+        while True:
+            claimed = self.client.xautoclaim(self.stream, GROUP, consumer,
+                                             min_idle_time=int(self.visibility_timeout * 1000), count=1)
+            # Redis 7 返回 [下一个游标, 消息列表, 已删除的 ID]，6.2 只有前两项
+            entries = claimed[1] if claimed and len(claimed) > 1 else []
+            entries = [e for e in entries if e and e[1]]
+            if entries:
+                job = self._job(*entries[0])
+                self.logger.warning(f"重新领取超时未确认的任务 {job['id']}（第 {job['attempts']} 次）。")
+                if job["attempts"] > self.max_attempts:
+                    self.logger.error(f"任务 {job['id']} 已尝试 {self.max_attempts} 次，放弃。")
+                    self.ack(job, error=f"任务已尝试 {self.max_attempts} 次仍未完成")
+                    continue
+                return job
+            response = self.client.xreadgroup(GROUP, consumer, {self.stream: ">"}, count=1,
+                                              block=max(1, int(block * 1000)))
+            if not response or not response[0][1]:
+                return None
+            return self._job(*response[0][1][0])
+
+    def ack(self, job, result=None, error=None):
+        """回复任务的结果（或错误信息）并确认，之后该任务不会再被领取。"""
+        reply = self._reply_key(job["id"])
+        pipe = self.client.pipeline()
+        pipe.rpush(reply, json.dumps({"result": result, "error": error}, ensure_ascii=False))
+        pipe.expire(reply, self.reply_ttl)
+        pipe.xack(self.stream, GROUP, job["entry"])
+        pipe.xdel(self.stream, job["entry"])
+        pipe.hdel(self._attempts_key(), job["entry"])
+        pipe.execute()
+
+    def stats(self):
+        """返回队列中的任务数：pending（已提交的全部未确认任务）和 in_progress（已领取未确认的任务）。"""
+        summary = self.client.xpending(self.stream, GROUP)
+        return {"pending": self.client.xlen(self.stream), "in_progress": summary["pending"]}
+
+
+class QueueWorker:
+    """
+    从 FrameQueue 领取任务并用 ImageAnalyzer 执行：vision 任务调用 analyze_image / analyze_images，
+    tts 任务调用语音合成。可以在多个线程中同时运行 run。
+
+    参数:
+    - queue: FrameQueue。
+    - make_analyzer: make_analyzer(options) 返回 ImageAnalyzer，options 为任务中的 model、language、detail 和
+      tts_model；相同的 options 复用同一个实例。
+    - consumer: 消费者名称前缀，默认为主机名和进程号。
+    """
+
+    def __init__(self, queue, make_analyzer, consumer=None, logger=None):
+        self.queue = queue
+        self.make_analyzer = make_analyzer
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.completed = 0
+        self.failed = 0
+        self._analyzers = {}
+        self._lock = threading.Lock()
+
+    def analyzer(self, options):
+        key = json.dumps(options, sort_keys=True)
+        with self._lock:
+            if key not in self._analyzers:
+                self._analyzers[key] = self.make_analyzer(options)
+            return self._analyzers[key]
+
+    def handle(self, job):
+        """执行一个任务并返回结果；vision 返回与帧数等长的解说列表，tts 返回 base64 编码的音频。"""
+        payload = job["payload"]
+        analyzer = self.analyzer(payload.get("options", {}))
+        if job["kind"] == "vision":
+            images = payload.get("images")
+            if images is None:
+                images = [analyzer.encode_image(f["path"]) for f in payload["frames"]]
+            if len(images) == 1:
+                return [analyzer.analyze_image(images[0], script=payload["script"])]
+            return analyzer.analyze_images(images, script=payload["script"])
+        audio = analyzer._speech_audio(payload["text"], payload["voice"], payload.get("index", 1))
+        if audio is None:
+            raise JobFailed("语音合成失败")
+        return base64.b64encode(audio).decode("utf-8")
+
+    def run(self, stop_event=None, max_jobs=None, thread_name=None):
+        """
+        循环领取并执行任务，直到 stop_event 被设置或完成 max_jobs 个任务。
+
+        返回:
+        - 本线程处理的任务数。
+        """
+        consumer = f"{self.consumer}-{thread_name or threading.current_thread().name}"
+        handled = 0
+        while (stop_event is None or not stop_event.is_set()) and (max_jobs is None or handled < max_jobs):
+            try:
+                job = self.queue.claim(consumer)
+            except redis.exceptions.ConnectionError as e:
+                self.logger.error(f"连接 Redis 时发生错误: {e}，稍后重试。")
+                time.sleep(1)
+                continue
+            if job is None:
+                continue
+            started = time.monotonic()
+            try:
+                result = self.handle(job)
+            except Exception as e:
+                self.logger.error(f"执行任务 {job['id']} 时发生错误: {e}")
+                self.queue.ack(job, error=str(e))
+                with self._lock:
+                    self.failed += 1
+            else:
+                self.queue.ack(job, result=result)
+                with self._lock:
+                    self.completed += 1
+                self.logger.info(f"✅ 任务 {job['id']}（{job['kind']}）完成，用时 {time.monotonic() - started:.2f} 秒。")
+            handled += 1
+        return handled
@@ -0,0 +1,90 @@
+# coding: utf-8
+"""
+分布式 worker：从 Redis 队列领取 runner.py --redis-url 提交的图像分析和语音合成任务并执行，可以在任意多台机器上运行。
+
+用法：python worker.py --redis-url redis://localhost:6379/0 --threads 4
+API 密钥和基本URL默认读取环境变量 OPENAI_API_KEY 和 OPENAI_BASE_URL，Redis 地址默认读取 REDIS_URL。
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+from content_cache import CACHE_MODES, ContentCache
+from metrics import Metrics
+from rate_limit import RateLimiter
+from video_narrator import ImageAnalyzer
+from work_queue import FrameQueue, QueueWorker
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="执行队列中的图像分析和语音合成任务")
+    parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL", "redis://localhost:6379/0"),
+                        help="Redis 地址，默认读取环境变量 REDIS_URL")
+    parser.add_argument("--queue", default="narrator", help="队列名称，须与 runner.py 的 --queue 相同")
+    parser.add_argument("--threads", type=int, default=4, help="同时执行的任务数，默认为4")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"),
+                        help="OpenAI API密钥，默认读取环境变量 OPENAI_API_KEY")
+    parser.add_argument("--base-url", default=os.environ.get("OPENAI_BASE_URL"),
+                        help="OpenAI API的基本URL，默认读取环境变量 OPENAI_BASE_URL")
+    parser.add_argument("--visibility-timeout", type=float, default=900,
+                        help="任务领取后多久未确认即交给其他 worker（秒），默认为900")
+    parser.add_argument("--max-attempts", type=int, default=3, help="每个任务最多被领取的次数")
+    parser.add_argument("--max-jobs", type=int, default=None, help="每个线程处理多少个任务后退出，默认一直运行")
+    parser.add_argument("--cache", choices=CACHE_MODES, default="use", help="缓存模式")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("缺少 OpenAI API密钥：请设置环境变量 OPENAI_API_KEY 或使用 --api-key")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    logger = logging.getLogger("worker")
+    queue = FrameQueue.from_url(args.redis_url, name=args.queue, visibility_timeout=args.visibility_timeout,
+                                max_attempts=args.max_attempts, logger=logger)
+    metrics = Metrics()
+    rate_limiter = RateLimiter()
+    cache = ContentCache(os.path.join(os.getcwd(), "cache", "analysis.sqlite3"), mode=args.cache)
+    audio_cache = ContentCache(os.path.join(os.getcwd(), "cache", "tts.sqlite3"), mode=args.cache,
+                               max_bytes=2 * 1024 * 1024 * 1024)
+
+    def make_analyzer(options):
+        return ImageAnalyzer(args.api_key, "alloy", base_url=args.base_url, logger=logger,
+                             language=options.get("language", "中文"), request_interval=0, cache=cache,
+                             model=options.get("model", "gpt-4o"), audio_cache=audio_cache,
+                             tts_model=options.get("tts_model", "tts-1"), rate_limiter=rate_limiter,
+                             image_detail=options.get("detail", "auto"), metrics=metrics)
+
+    worker = QueueWorker(queue, make_analyzer, logger=logger)
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=worker.run, name=f"t{i}",
+                                kwargs={"stop_event": stop_event, "max_jobs": args.max_jobs})
+               for i in range(max(1, args.threads))]
+    logger.info(f"worker {worker.consumer} 开始领取队列 {args.queue} 中的任务（{len(threads)} 个线程）。")
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        # 正在执行的任务完成后退出；未完成的任务在 visibility_timeout 后由其他 worker 重新领取
+        logger.info("正在停止，等待进行中的任务完成...")
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        cache.close()
+        audio_cache.close()
+        path, _ = metrics.export(os.path.join(os.getcwd(), "metrics", f"worker_{worker.consumer}"))
+    logger.info(f"共完成 {worker.completed} 个任务，失败 {worker.failed} 个，用时 {time.monotonic() - started:.1f} 秒。"
+                f"统计数据已保存到: {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())